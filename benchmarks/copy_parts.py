@@ -0,0 +1,72 @@
+"""
+Measures how the Redshift COPY time of one synthetic crime month changes with the number of parts it is split into.
+
+For every part count the month is written with MonthPartWriters (the writer used by the pull operators), loaded
+through its manifest into a temp table created LIKE staging_crimes, and the COPY is timed. Runs against the S3
+bucket and Redshift cluster of the Airflow connections, e.g.
+
+    python benchmarks/copy_parts.py --rows 2000000 --parts 1 2 4 8 16 --gzip
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+import boto3
+import pandas as pd
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
+
+from helpers.stand_ins import synthetic_crime_records
+from helpers.staging_files import MonthPartWriters, write_frame
+from operators.pull_crime_data import SocrataToS3Operator
+from operators.s3_to_staging_redshift import StageToRedshiftOperator
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--parts", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--bucket", default="udacitycapstoneprojectbucket")
+    parser.add_argument("--aws-conn-id", default="aws_connection")
+    parser.add_argument("--redshift-conn-id", default="redshift_conn")
+    args = parser.parse_args()
+
+    credentials = AwsBaseHook(args.aws_conn_id, client_type="s3").get_credentials()
+    s3 = boto3.client('s3', aws_access_key_id=credentials.access_key, aws_secret_access_key=credentials.secret_key)
+    redshift = PostgresHook(postgres_conn_id=args.redshift_conn_id)
+
+    df = pd.DataFrame.from_records(synthetic_crime_records(2001, 1, args.rows), columns=SocrataToS3Operator.columns)
+    print("{:>6} {:>12} {:>10} {:>12}".format("parts", "bytes", "copy_s", "rows_per_s"))
+    for num_parts in args.parts:
+        with MonthPartWriters(s3, args.bucket, "benchmark/crime", 2001, "01",
+                              num_parts=num_parts, compress=args.gzip) as parts:
+            write_frame(df, parts, "crime")
+        total_bytes = sum(upload.bytes_written for upload in parts.uploads)
+        if parts.manifest_key is None:
+            source = "s3://{}/{}".format(args.bucket, parts.keys[0])
+        else:
+            source = "s3://{}/{}".format(args.bucket, parts.manifest_key)
+        copy_sql = StageToRedshiftOperator.copy_sql.format(
+            "benchmark_staging_crimes", source, credentials.access_key, credentials.secret_key)
+        if parts.manifest_key is not None:
+            copy_sql += StageToRedshiftOperator.manifest_option
+        if args.gzip:
+            copy_sql += StageToRedshiftOperator.gzip_option
+
+        conn = redshift.get_conn()
+        cursor = conn.cursor()
+        cursor.execute("CREATE TEMP TABLE benchmark_staging_crimes (LIKE staging_crimes)")
+        start = time.time()
+        cursor.execute(copy_sql)
+        elapsed = time.time() - start
+        conn.rollback()
+        conn.close()
+        print("{:>6} {:>12} {:>10.2f} {:>12.0f}".format(num_parts, total_bytes, elapsed, args.rows / elapsed))
+
+
+if __name__ == "__main__":
+    main()
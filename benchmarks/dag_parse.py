@@ -0,0 +1,124 @@
+"""
+Measures how long the scheduler's DAG file processor takes to import each DAG file and how much memory the import
+adds, and fails when the import loads a heavy client library or got slower or bigger than the recorded baseline.
+
+Every import runs in a fresh interpreter with airflow already imported, as it is in the DAG file processor, so
+only the cost of the DAG file and the plugins it imports is measured. pandas, pyarrow, boto3, sodapy, aiohttp,
+duckdb and the BigQuery client are only needed when a task runs; loading any of them while parsing fails the check, e.g.
+
+    python benchmarks/dag_parse.py --record      # writes benchmarks/dag_parse_baseline.json
+    python benchmarks/dag_parse.py               # compares against it, exits with 1 on a regression
+
+Without a baseline, or without the baseline of a DAG file, the check fails too, so record one on the machine that
+runs the check before the first comparison.
+
+Requires apache-airflow with the amazon and postgres providers.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+repo_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+dag_files = ["dags/dag.py", "dags/backfill_dag.py"]
+
+heavy_modules = ["pandas", "pyarrow", "boto3", "botocore", "sodapy", "aiohttp", "google.cloud.bigquery", "duckdb"]
+
+baseline_path = os.path.join(repo_root, "benchmarks", "dag_parse_baseline.json")
+
+
+def import_dag_file(path):
+    """Child process: imports one DAG file and prints its import time, memory growth and heavy modules."""
+    import importlib.util
+    sys.path.insert(0, os.path.join(repo_root, "plugins"))
+    sys.path.insert(0, os.path.join(repo_root, "dags"))
+    import airflow  # noqa: F401, imported by the DAG file processor before any DAG file
+
+    loaded_before = set(sys.modules)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    spec = importlib.util.spec_from_file_location("parsed_dag", os.path.join(repo_root, path))
+    spec.loader.exec_module(importlib.util.module_from_spec(spec))
+    import_s = time.perf_counter() - started
+    loaded = set(sys.modules) - loaded_before
+    print(json.dumps({
+        "import_s": round(import_s, 4),
+        # ru_maxrss is in kilobytes on Linux
+        "rss_growth_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+        "modules": len(loaded),
+        "heavy_modules": sorted(module for module in heavy_modules if module in loaded),
+    }))
+
+
+def measure(path, repeat):
+    """Imports the DAG file `repeat` times, each in a fresh interpreter, and returns the median of the runs."""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", path],
+                                check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    return {
+        "import_s": round(statistics.median(run["import_s"] for run in runs), 4),
+        "rss_growth_mb": round(statistics.median(run["rss_growth_mb"] for run in runs), 1),
+        "modules": runs[-1]["modules"],
+        "heavy_modules": sorted(set(module for run in runs for module in run["heavy_modules"])),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative growth of the import time and memory over the baseline")
+    parser.add_argument("--baseline", default=baseline_path)
+    parser.add_argument("--record", action="store_true", help="write the measured times and memory as the new baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import_dag_file(args.child)
+        return
+
+    results = {path: measure(path, args.repeat) for path in dag_files}
+    print("\t".join(["dag_file", "import_s", "rss_growth_mb", "modules", "heavy_modules"]))
+    for path, result in results.items():
+        print("\t".join([path, str(result["import_s"]), str(result["rss_growth_mb"]), str(result["modules"]),
+                         ",".join(result["heavy_modules"]) or "-"]))
+
+    failures = ["{} imports {} while parsing".format(path, ", ".join(result["heavy_modules"]))
+                for path, result in results.items() if result["heavy_modules"]]
+    if args.record:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump({path: {"import_s": result["import_s"], "rss_growth_mb": result["rss_growth_mb"]}
+                       for path, result in results.items()},
+                      baseline_file, indent=2, sort_keys=True)
+        print("Recorded the baseline in {}".format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        for path, result in results.items():
+            for measure_name, unit in (("import_s", "s"), ("rss_growth_mb", " MB")):
+                if measure_name not in baseline.get(path, {}):
+                    failures.append("{} has no {} baseline in {}, record one with --record".format(
+                        path, measure_name, args.baseline))
+                    continue
+                limit = baseline[path][measure_name] * (1 + args.tolerance)
+                if result[measure_name] > limit:
+                    failures.append("{} {} is {}{}, over {}{} (baseline {}{} + {:.0%})".format(
+                        path, measure_name, result[measure_name], unit, round(limit, 4), unit,
+                        baseline[path][measure_name], unit, args.tolerance))
+    else:
+        failures.append("No baseline at {}, record one with --record".format(args.baseline))
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
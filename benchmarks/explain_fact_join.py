@@ -0,0 +1,66 @@
+"""
+Compares the Redshift query plans of the crime-weather fact join before and after the weather_date key.
+
+The "before" query joins on the date built from the year, month and day strings of every weather row; the
+"after" query is SqlQueries.fact_daily_crime_weather_incremental_insert, joining on weather_date. Both are
+EXPLAINed for the same interval against the staging tables of the Airflow connection, and the plans are printed
+with their estimated cost and the data redistribution steps they contain, e.g.
+
+    python benchmarks/explain_fact_join.py --start 2001-01-01 --end 2001-02-01
+"""
+import argparse
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+from airflow.hooks.postgres_hook import PostgresHook
+
+from helpers.sql_queries import SqlQueries
+
+string_key_join = SqlQueries.fact_daily_crime_weather_incremental_insert.replace(
+    "staging_weather.weather_date",
+    "(staging_weather.year::text || '-' || staging_weather.month::text || '-' || staging_weather.day::text)::date")
+
+redistribution_steps = ("DS_BCAST_INNER", "DS_DIST_ALL_INNER", "DS_DIST_INNER", "DS_DIST_OUTER", "DS_DIST_BOTH")
+
+
+def explain(redshift, sql):
+    return [row[0] for row in redshift.get_records("EXPLAIN " + sql)]
+
+
+def summarize(plan):
+    cost = re.search(r"cost=[\d.]+\.\.([\d.]+)", plan[0])
+    joins = [step for step in ("Merge Join", "Hash Join", "Nested Loop") if any(step in line for line in plan)]
+    redistribution = sorted({step for step in redistribution_steps for line in plan if step in line})
+    return {
+        "total_cost": float(cost.group(1)) if cost else None,
+        "joins": ", ".join(joins) or "-",
+        "redistribution": ", ".join(redistribution) or "DS_DIST_NONE",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--start", default="2001-01-01")
+    parser.add_argument("--end", default="2001-02-01")
+    parser.add_argument("--redshift-conn-id", default="redshift_conn")
+    args = parser.parse_args()
+
+    redshift = PostgresHook(postgres_conn_id=args.redshift_conn_id)
+    summaries = {}
+    for name, sql in (("before", string_key_join), ("after", SqlQueries.fact_daily_crime_weather_incremental_insert)):
+        plan = explain(redshift, sql.format(start=args.start, end=args.end))
+        summaries[name] = summarize(plan)
+        print("-- {} --".format(name))
+        print("\n".join(plan))
+        print()
+
+    print("{:<8} {:>14} {:<24} {}".format("query", "total_cost", "joins", "redistribution"))
+    for name, summary in summaries.items():
+        print("{:<8} {:>14} {:<24} {}".format(name, summary["total_cost"], summary["joins"], summary["redistribution"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Measures how long StationIndex takes to assign synthetic crimes to their nearest weather station, and checks the
+assignment against a brute-force great-circle search on a sample of the points, e.g.
+
+    python benchmarks/station_assignment.py --rows 1000000 5000000 --page-size 50000
+
+The points are spread uniformly over the city and assigned page by page, as SocrataToS3Operator does.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "plugins"))
+
+import numpy as np
+
+from helpers.stand_ins import LocalBigQueryClient
+from helpers.stations import StationIndex, gsod_stations
+
+
+def haversine_nearest(latitudes, longitudes, stations):
+    """Returns the nearest station of every point by great-circle distance, comparing every point to every station."""
+    station_latitudes = np.radians([latitude for _, latitude, _ in stations])
+    station_longitudes = np.radians([longitude for _, _, longitude in stations])
+    latitudes = np.radians(latitudes)[:, None]
+    longitudes = np.radians(longitudes)[:, None]
+    distances = (np.sin((station_latitudes - latitudes) / 2) ** 2 +
+                 np.cos(latitudes) * np.cos(station_latitudes) * np.sin((station_longitudes - longitudes) / 2) ** 2)
+    return np.array([station for station, _, _ in stations], dtype=object)[distances.argmin(axis=1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000000, 5000000])
+    parser.add_argument("--page-size", type=int, default=50000)
+    parser.add_argument("--sample", type=int, default=100000, help="points checked against the brute-force search")
+    args = parser.parse_args()
+
+    stations = gsod_stations(LocalBigQueryClient(), [41.5, -88.0, 42.1, -87.5], "20200101", "20201231")
+    rng = np.random.default_rng(0)
+    print("\t".join(["rows", "index_s", "assign_s", "rows_per_s", "mismatches"]))
+    for rows in args.rows:
+        latitudes = rng.uniform(41.645, 42.022, rows)
+        longitudes = rng.uniform(-87.934, -87.525, rows)
+        start = time.perf_counter()
+        index = StationIndex(stations)
+        index_s = time.perf_counter() - start
+        start = time.perf_counter()
+        assigned = np.concatenate([index.assign(latitudes[page:page + args.page_size],
+                                                longitudes[page:page + args.page_size])
+                                   for page in range(0, rows, args.page_size)])
+        assign_s = time.perf_counter() - start
+        sample = min(args.sample, rows)
+        mismatches = int((haversine_nearest(latitudes[:sample], longitudes[:sample], stations)
+                          != assigned[:sample]).sum())
+        print("\t".join([str(rows), str(round(index_s, 4)), str(round(assign_s, 3)),
+                         str(round(rows / assign_s)), str(mismatches)]))
+
+
+if __name__ == "__main__":
+    main()
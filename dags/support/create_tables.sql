@@ -9,8 +9,13 @@ CREATE TABLE public.staging_crimes (
 	domestic boolean,
 	district int4,
 	ward int4,
-	community_area int4
-);
+	community_area int4,
+	latitude double precision,
+	longitude double precision,
+	station varchar(12)
+)
+DISTSTYLE EVEN
+SORTKEY (crime_date);
 
 CREATE TABLE public.staging_weather (
     id int primary key,
@@ -22,11 +27,18 @@ CREATE TABLE public.staging_weather (
 	fog boolean default false,
 	rain_drizzle boolean default false,
 	snow_ice_pellets boolean default false,
-	thunder boolean default false
-);
+	thunder boolean default false,
+	weather_date DATE,
+	station varchar(12),
+	latitude double precision,
+	longitude double precision
+)
+DISTSTYLE ALL
+SORTKEY (weather_date);
 
 CREATE TABLE public.fact_daily_crime_weather(
     crime_date DATE,
+    station varchar(12),
     crime_count int4,
     arrest_count int4,
     domestic_count int4,
@@ -36,9 +48,11 @@ CREATE TABLE public.fact_daily_crime_weather(
 	rain_drizzle boolean default false,
 	snow_ice_pellets boolean default false,
 	thunder boolean default false,
-    CONSTRAINT daily_crime_weather_pkey PRIMARY KEY (crime_date)
+    CONSTRAINT daily_crime_weather_pkey PRIMARY KEY (crime_date, station)
 
-);
+)
+DISTSTYLE ALL
+SORTKEY (crime_date);
 
 CREATE TABLE public.crime(
     primary_type varchar(50),
@@ -77,9 +91,64 @@ CREATE TABLE public.daily_weather (
 	month int4,
 	day int4,
 	temp double precision,
+	windspeed double precision,
+	fog boolean default false,
+	rain_drizzle boolean default false,
+	snow_ice_pellets boolean default false,
+	thunder boolean default false,
+	weather_date DATE,
+	station varchar(12),
+	latitude double precision,
+	longitude double precision
+)
+SORTKEY (weather_date);
+
+CREATE TABLE public.crime_weather_weekly(
+    week_start DATE,
+    days int4,
+    crime_count int4,
+    arrest_count int4,
+    domestic_count int4,
+    temp double precision,
+	windspeed double precision,
+	fog_days int4,
+	rain_drizzle_days int4,
+	snow_ice_pellets_days int4,
+	thunder_days int4,
+    CONSTRAINT crime_weather_weekly_pkey PRIMARY KEY (week_start)
+)
+DISTSTYLE ALL
+SORTKEY (week_start);
+
+CREATE TABLE public.crime_weather_monthly(
+    month_start DATE,
+    days int4,
+    crime_count int4,
+    arrest_count int4,
+    domestic_count int4,
+    temp double precision,
+	windspeed double precision,
+	fog_days int4,
+	rain_drizzle_days int4,
+	snow_ice_pellets_days int4,
+	thunder_days int4,
+    CONSTRAINT crime_weather_monthly_pkey PRIMARY KEY (month_start)
+)
+DISTSTYLE ALL
+SORTKEY (month_start);
+
+CREATE TABLE public.crime_community_area_daily(
+    crime_date DATE,
+    community_area int4,
+    crime_count int4,
+    arrest_count int4,
+    domestic_count int4,
+    temp double precision,
 	windspeed double precision,
 	fog boolean default false,
 	rain_drizzle boolean default false,
 	snow_ice_pellets boolean default false,
 	thunder boolean default false
-);
+)
+DISTSTYLE EVEN
+COMPOUND SORTKEY (crime_date, community_area);
@@ -0,0 +1,103 @@
+"""
+Change detection between the monthly extracts written by the pull operators and the extracts last loaded into Redshift.
+
+The pull operators fingerprint every month they write and compare it with the marker object recorded after the
+month was last loaded. `extracts_changed` gates the downstream tasks with a ShortCircuitOperator (or
+`load_if_extracts_changed` with a BranchPythonOperator) and `record_loaded_extracts` writes the markers once the
+run has loaded the extracts.
+"""
+from helpers.clients import s3_client
+from helpers.staging_files import loaded_marker_key
+
+
+def read_loaded_fingerprint(s3, bucket, key):
+    """Returns the fingerprint stored in a loaded marker, None if the month was never loaded."""
+    from botocore.exceptions import ClientError
+    try:
+        response = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+            return None
+        raise
+    return response["Body"].read().decode("utf-8").strip()
+
+
+class ExtractChanges:
+    """
+    Collects the fingerprints of the months written by a pull operator and whether any of them differs from
+    the month last loaded into Redshift.
+
+    Attributes
+    ----------
+    s3 : botocore client
+        boto3 S3 client
+    bucket : str
+        S3 bucket of the extracts
+    folder : str
+        S3 folder of the extracts
+    detect : bool
+        compare the months with the loaded markers; when False every run counts as changed
+    fingerprints : dict
+        loaded marker key to fingerprint of every month written so far
+    changed : bool
+        whether any month differs from the loaded one
+
+    Methods
+    -------
+    add(year, month, parts):
+        Records the fingerprint of a closed MonthPartWriters and returns whether the month changed.
+    push(context):
+        Pushes `changed` and `fingerprints` to XCom.
+    """
+
+    def __init__(self, s3, bucket, folder, detect=True):
+        self.s3 = s3
+        self.bucket = bucket
+        self.folder = folder
+        self.detect = detect
+        self.fingerprints = {}
+        self.changed = not detect
+
+    def add(self, year, month, parts):
+        marker = loaded_marker_key(self.folder, year, month)
+        fingerprint = parts.fingerprint()
+        self.fingerprints[marker] = fingerprint
+        if not self.detect:
+            return True
+        month_changed = read_loaded_fingerprint(self.s3, self.bucket, marker) != fingerprint
+        self.changed = self.changed or month_changed
+        return month_changed
+
+    def push(self, context):
+        context["ti"].xcom_push(key="changed", value=self.changed)
+        context["ti"].xcom_push(key="fingerprints", value=self.fingerprints)
+
+
+def extracts_changed(task_ids, **context):
+    """
+    ShortCircuitOperator callable: True when any of the pull tasks wrote a month that differs from the loaded one.
+    A pull task without a `changed` XCom counts as changed.
+    """
+    ti = context["ti"]
+    return any(ti.xcom_pull(task_ids=task_id, key="changed") is not False for task_id in task_ids)
+
+
+def load_if_extracts_changed(task_ids, **context):
+    """
+    BranchPythonOperator callable: follows every downstream task (the staging COPYs) when any of the pull tasks
+    wrote a month that differs from the loaded one, and none of them otherwise, so the loads after them are
+    skipped too.
+    """
+    if extracts_changed(task_ids, **context):
+        return sorted(context["task"].downstream_task_ids)
+    return []
+
+
+def record_loaded_extracts(aws_credentials_id, task_ids, bucket="udacitycapstoneprojectbucket", **context):
+    """PythonOperator callable writing the loaded markers of the months fingerprinted by the pull tasks."""
+    s3 = s3_client(aws_credentials_id)
+    ti = context["ti"]
+    for task_id in task_ids:
+        fingerprints = ti.xcom_pull(task_ids=task_id, key="fingerprints") or {}
+        for marker, fingerprint in fingerprints.items():
+            s3.put_object(Bucket=bucket, Key=marker, Body=fingerprint.encode("utf-8"))
@@ -0,0 +1,89 @@
+"""
+Clients and credentials of the external services, created on first use and cached for the worker process.
+
+boto3, sodapy and google.cloud.bigquery are imported inside the functions, so parsing a DAG that imports the
+operators loads none of them; a task pays for the imports and the client setup once, however many months or
+operators it runs. AWS credentials, and the boto3 clients signing with them, are only kept for
+`aws_credentials_ttl` seconds, so temporary (session token) credentials are renewed before they expire and edits
+to the Airflow connection are picked up without restarting the worker.
+"""
+import configparser
+import functools
+import os
+import threading
+import time
+
+config_path = 'dags/support/dwh.cfg'
+
+aws_credentials_ttl = 300
+
+
+def ttl_cache(seconds):
+    """Like functools.lru_cache(maxsize=None), but an entry older than `seconds` is created again on its next use."""
+    def decorator(function):
+        entries = {}
+        lock = threading.Lock()
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = args + tuple(sorted(kwargs.items()))
+            now = time.monotonic()
+            with lock:
+                entry = entries.get(key)
+            if entry is not None and now - entry[0] < seconds:
+                return entry[1]
+            value = function(*args, **kwargs)
+            with lock:
+                entries[key] = (now, value)
+            return value
+        wrapper.cache_clear = entries.clear
+        return wrapper
+    return decorator
+
+
+@functools.lru_cache(maxsize=None)
+def pipeline_config(path=config_path):
+    """Returns the parsed dwh.cfg of the pipeline."""
+    config = configparser.ConfigParser()
+    with open(path) as config_file:
+        config.read_file(config_file)
+    return config
+
+
+def socrata_app_token():
+    return pipeline_config().get('SOCRATA', 'key')
+
+
+@ttl_cache(aws_credentials_ttl)
+def aws_credentials(aws_credentials_id):
+    """Returns the frozen credentials (access_key, secret_key, token) of an Airflow AWS connection."""
+    from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
+    return AwsBaseHook(aws_credentials_id, client_type="s3").get_credentials()
+
+
+@ttl_cache(aws_credentials_ttl)
+def aws_client(aws_credentials_id, service_name="s3", region_name=None):
+    """Returns a boto3 client of the service; it gets its own session, as the default session is not thread safe."""
+    import boto3
+    credentials = aws_credentials(aws_credentials_id)
+    session = boto3.session.Session(aws_access_key_id=credentials.access_key,
+                                    aws_secret_access_key=credentials.secret_key,
+                                    aws_session_token=credentials.token,
+                                    region_name=region_name)
+    return session.client(service_name)
+
+
+def s3_client(aws_credentials_id):
+    return aws_client(aws_credentials_id, "s3")
+
+
+@functools.lru_cache(maxsize=None)
+def socrata_client(domain, app_token):
+    from sodapy import Socrata
+    return Socrata(domain, app_token)
+
+
+@functools.lru_cache(maxsize=None)
+def bigquery_client():
+    from google.cloud import bigquery
+    return bigquery.Client.from_service_account_json(os.environ['GOOGLE_APPLICATION_CREDENTIALS'])
@@ -0,0 +1,129 @@
+"""
+Builds the pipeline DAGs from a declarative spec.
+
+Every task of a spec names the datasets it reads and writes (S3 folders, Redshift tables, ...). The factory wires
+each task after the producers of what it reads, and tasks that drop datasets after every task that touches them,
+then removes the edges implied by longer paths. Sources therefore run in independent extract -> stage lanes and
+loads only wait for the tables they actually read. The critical path of the resulting graph is computed from
+the duration estimates of the spec.
+
+A task spec is a dict with:
+    task_id, operator: the task id and operator class
+    kwargs: keyword arguments of the operator
+    reads, writes, drops: names of the datasets the task reads, writes or drops
+    after: task ids the task has to run after regardless of the datasets (optional)
+    pool: Airflow pool of the task (optional)
+    estimate: expected duration in minutes, used for the critical path (optional)
+"""
+from airflow.operators.dummy_operator import DummyOperator
+from airflow.utils.trigger_rule import TriggerRule
+
+
+def task_dependencies(tasks):
+    """Returns the minimal set of upstream task ids of every task, derived from the datasets of the spec."""
+    producers = {}
+    for task in tasks:
+        for dataset in task.get("writes", []):
+            if dataset in producers:
+                raise ValueError("Dataset {} is written by both {} and {}".format(
+                    dataset, producers[dataset], task["task_id"]))
+            producers[dataset] = task["task_id"]
+
+    upstream = {task["task_id"]: set(task.get("after", [])) for task in tasks}
+    for task_id, parents in upstream.items():
+        if not parents <= set(upstream):
+            raise ValueError("Task {} runs after unknown tasks {}".format(task_id, sorted(parents - set(upstream))))
+    for task in tasks:
+        for dataset in task.get("reads", []):
+            if dataset not in producers:
+                raise ValueError("Task {} reads {}, which no task writes".format(task["task_id"], dataset))
+            upstream[task["task_id"]].add(producers[dataset])
+        for dataset in task.get("drops", []):
+            upstream[task["task_id"]].update(
+                other["task_id"] for other in tasks
+                if other is not task and (dataset in other.get("reads", []) or dataset in other.get("writes", [])))
+
+    order = topological_order(upstream)
+    ancestors = {}
+    for task_id in order:
+        ancestors[task_id] = set(upstream[task_id])
+        for parent in upstream[task_id]:
+            ancestors[task_id] |= ancestors[parent]
+
+    for task in tasks:
+        # An edge implied by a longer path is only redundant for all_success tasks: a task with another trigger
+        # rule (e.g. the staging cleanup) may run once an intermediate task is skipped, so it keeps every edge.
+        if task.get("kwargs", {}).get("trigger_rule", TriggerRule.ALL_SUCCESS) != TriggerRule.ALL_SUCCESS:
+            continue
+        parents = upstream[task["task_id"]]
+        upstream[task["task_id"]] = {parent for parent in parents
+                                     if not any(parent in ancestors[other] for other in parents if other != parent)}
+    return upstream
+
+
+def topological_order(upstream):
+    order = []
+    state = {}
+
+    def visit(task_id):
+        if state.get(task_id) == "done":
+            return
+        if state.get(task_id) == "visiting":
+            raise ValueError("The pipeline spec has a cycle through {}".format(task_id))
+        state[task_id] = "visiting"
+        for parent in sorted(upstream[task_id]):
+            visit(parent)
+        state[task_id] = "done"
+        order.append(task_id)
+
+    for task_id in upstream:
+        visit(task_id)
+    return order
+
+
+def critical_path(tasks, upstream):
+    """Returns the estimated minutes and the task ids of the longest path through the graph."""
+    estimates = {task["task_id"]: task.get("estimate", 0) for task in tasks}
+    finish = {}
+    previous = {}
+    for task_id in topological_order(upstream):
+        parent = max(upstream[task_id], key=lambda other: finish[other], default=None)
+        previous[task_id] = parent
+        finish[task_id] = (finish[parent] if parent is not None else 0) + estimates[task_id]
+
+    task_id = max(finish, key=finish.get)
+    minutes = finish[task_id]
+    path = []
+    while task_id is not None:
+        path.append(task_id)
+        task_id = previous[task_id]
+    return minutes, path[::-1]
+
+
+def build_dag(dag, tasks, start_task_id="Begin_execution", end_task_id="Stop_execution"):
+    """
+    Creates the operators of the spec in the DAG, wires them and documents the critical path on the DAG.
+    Returns the operators by task id.
+    """
+    upstream = task_dependencies(tasks)
+    operators = {}
+    for task in tasks:
+        kwargs = dict(task.get("kwargs", {}))
+        if task.get("pool"):
+            kwargs["pool"] = task["pool"]
+        operators[task["task_id"]] = task["operator"](task_id=task["task_id"], dag=dag, **kwargs)
+
+    start_operator = DummyOperator(task_id=start_task_id, dag=dag)
+    end_operator = DummyOperator(task_id=end_task_id, dag=dag)
+    downstream = {task_id for parents in upstream.values() for task_id in parents}
+    for task_id, parents in upstream.items():
+        for parent in sorted(parents):
+            operators[parent] >> operators[task_id]
+        if not parents:
+            start_operator >> operators[task_id]
+        if task_id not in downstream:
+            operators[task_id] >> end_operator
+
+    minutes, path = critical_path(tasks, upstream)
+    dag.doc_md = "Estimated critical path: {} minutes ({})".format(minutes, " -> ".join(path))
+    return operators
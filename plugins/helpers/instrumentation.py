@@ -0,0 +1,230 @@
+"""
+Shared instrumentation of the pipeline operators: phase timings, row and byte counts, peak memory and Redshift
+query ids of every task run, pushed to XCom and emitted to StatsD.
+"""
+import functools
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from airflow.configuration import conf
+from airflow.exceptions import TaskDeferred
+from airflow.stats import Stats
+
+
+class OperatorMetrics:
+    """
+    Collects the metrics of one operator run.
+
+    Phases are timed exclusively: time spent in a nested phase (e.g. an S3 upload triggered while serializing a
+    page) is only counted for the nested phase. Phases may be entered from several threads.
+
+    Attributes
+    ----------
+    task_id : str
+        task the metrics belong to
+    operator : str
+        class name of the operator
+    phases : dict
+        phase name to seconds spent in it
+    counters : dict
+        counter name (rows, bytes_written, ...) to value
+    query_ids : list
+        Redshift query ids of the statements run through the metrics
+    backend : str
+        warehouse backend the statements ran on ("redshift" or "duckdb"), None if the task ran none
+
+    Methods
+    -------
+    phase(name):
+        Context manager timing a phase.
+    count(name, value):
+        Adds a value to a counter.
+    execute(cursor, statement, phase):
+        Executes a statement on a cursor and records its query id; returns the rows when fetch is set.
+    record_statement(outcome, phase):
+        Adds the duration and query ids of a statement run outside of the task to a phase.
+    run(redshift, statements, phase, autocommit):
+        Runs statements on one connection like PostgresHook.run and returns their row counts.
+    get_records(redshift, sql, phase):
+        Like PostgresHook.get_records.
+    report():
+        Returns the metrics as a dict.
+    state():
+        Returns what has been measured so far, to be resumed with `restore` after the task deferred.
+    restore(state):
+        Adds the measurements of the run before the task deferred.
+    publish(context):
+        Pushes the report to XCom under `metrics` and emits it to StatsD.
+    """
+
+    stats_prefix = "crime_weather"
+
+    row_counters = {"INSERT": "rows_inserted", "DELETE": "rows_deleted"}
+
+    def __init__(self, task_id, operator):
+        self.task_id = task_id
+        self.operator = operator
+        self.phases = {}
+        self.counters = {}
+        self.query_ids = []
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.has_query_ids = None
+        self.backend = None
+
+    @contextmanager
+    def phase(self, name):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        start = time.time()
+        stack.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.time() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+
+    def count(self, name, value):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def execute(self, cursor, statement, phase="sql", fetch=False):
+        with self.phase(phase):
+            cursor.execute(statement)
+            records = cursor.fetchall() if fetch else cursor.rowcount
+        keyword = statement.split(None, 1)[0].upper() if statement.strip() else ""
+        if keyword in OperatorMetrics.row_counters and cursor.rowcount >= 0:
+            self.count(OperatorMetrics.row_counters[keyword], cursor.rowcount)
+        # Cursors of the embedded backend (helpers.warehouse) name it; anything else is a Postgres connection.
+        self.backend = getattr(cursor, "backend", "redshift")
+        if self.backend != "redshift":
+            return records
+        if self.has_query_ids is None:
+            # pg_last_query_id and pg_last_copy_count are Redshift only; calling them on PostgreSQL would abort
+            # the transaction.
+            cursor.execute("SELECT 1 FROM pg_proc WHERE proname = 'pg_last_query_id'")
+            self.has_query_ids = bool(cursor.fetchall())
+        if self.has_query_ids:
+            cursor.execute("SELECT pg_last_query_id()")
+            with self.lock:
+                self.query_ids.append(cursor.fetchone()[0])
+            if keyword == "COPY":
+                cursor.execute("SELECT pg_last_copy_count()")
+                self.count("rows_copied", cursor.fetchone()[0])
+        return records
+
+    def record_statement(self, outcome, phase="sql"):
+        """Records a statement that ran outside of the task, e.g. through the Redshift Data API."""
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + outcome["duration_s"]
+            self.query_ids.extend(outcome["redshift_query_ids"])
+        self.backend = "redshift"
+        if outcome.get("result_rows", -1) >= 0:
+            self.count("rows_affected", outcome["result_rows"])
+
+    def run(self, redshift, statements, phase="sql", autocommit=False):
+        if isinstance(statements, str):
+            statements = [statements]
+        conn = redshift.get_conn()
+        try:
+            redshift.set_autocommit(conn, autocommit)
+            cursor = conn.cursor()
+            row_counts = [self.execute(cursor, statement, phase) for statement in statements]
+            if not autocommit:
+                conn.commit()
+        except Exception:
+            if not autocommit:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return row_counts
+
+    def get_records(self, redshift, sql, phase="sql"):
+        conn = redshift.get_conn()
+        try:
+            return self.execute(conn.cursor(), sql, phase, fetch=True)
+        finally:
+            conn.close()
+
+    def report(self):
+        return {
+            "task_id": self.task_id,
+            "operator": self.operator,
+            "duration_s": round(time.time() - self.started, 3),
+            "phases_s": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "counters": dict(self.counters),
+            # ru_maxrss is reported in KiB on Linux
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "redshift_query_ids": list(self.query_ids),
+            "backend": self.backend,
+        }
+
+    def state(self):
+        with self.lock:
+            return {"started": self.started, "phases": dict(self.phases), "counters": dict(self.counters),
+                    "query_ids": list(self.query_ids)}
+
+    def restore(self, state):
+        with self.lock:
+            self.started = min(self.started, state["started"])
+            for name, seconds in state["phases"].items():
+                self.phases[name] = self.phases.get(name, 0.0) + seconds
+            for name, value in state["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.query_ids.extend(state["query_ids"])
+
+    def publish(self, context):
+        report = self.report()
+        context["ti"].xcom_push(key="metrics", value=report)
+        if not conf.getboolean("metrics", "pipeline_metrics_on", fallback=True):
+            return report
+        prefix = "{}.{}".format(OperatorMetrics.stats_prefix, self.task_id)
+        Stats.timing("{}.duration".format(prefix), timedelta(seconds=report["duration_s"]))
+        for name, seconds in report["phases_s"].items():
+            Stats.timing("{}.phase.{}".format(prefix, name), timedelta(seconds=seconds))
+        for name, value in report["counters"].items():
+            Stats.gauge("{}.{}".format(prefix, name), value)
+        Stats.gauge("{}.peak_rss_bytes".format(prefix), report["peak_rss_bytes"])
+        return report
+
+
+def instrumented(execute):
+    """
+    Decorates an operator's execute (or the method resuming a deferred task): the run is measured with an
+    OperatorMetrics available as self.metrics, which is published when the method returns or raises.
+
+    A task deferring publishes nothing: the measurements so far travel in the kwargs of the resuming method, so
+    the task is reported once, when it finishes.
+    """
+    @functools.wraps(execute)
+    def wrapper(self, context, *args, **kwargs):
+        self.metrics = OperatorMetrics(self.task_id, type(self).__name__)
+        deferred_metrics = kwargs.pop("deferred_metrics", None)
+        if deferred_metrics:
+            self.metrics.restore(deferred_metrics)
+        deferred = False
+        try:
+            return execute(self, context, *args, **kwargs)
+        except TaskDeferred as deferral:
+            deferred = True
+            deferral.kwargs = dict(deferral.kwargs or {}, deferred_metrics=self.metrics.state())
+            raise
+        finally:
+            if not deferred:
+                # A failing XCom push or StatsD client must not replace the outcome of the task
+                try:
+                    report = self.metrics.publish(context)
+                    self.log.info("Metrics: {}".format(report))
+                except Exception as error:
+                    self.log.warning("Could not publish the metrics of {}: {}".format(self.task_id, error))
+    return wrapper
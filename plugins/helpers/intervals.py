@@ -0,0 +1,13 @@
+def months_in_interval(context):
+    """
+    Returns (year, zero padded month) for every month starting inside the run's data interval.
+    A monthly run yields its own month, a range backfill run yields every month of the range.
+    """
+    start = context["data_interval_start"].date()
+    end = context["data_interval_end"].date()
+    year, month = start.year, start.month
+    months = []
+    while (year, month) < (end.year, end.month) or not months:
+        months.append((year, "{:02d}".format(month)))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
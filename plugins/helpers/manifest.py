@@ -0,0 +1,20 @@
+import json
+
+
+def build_manifest(entries):
+    """
+    Builds a Redshift COPY manifest from (s3 url, content length) pairs. The content length is required
+    by COPY from columnar formats and is left out of the entry when it is None.
+    """
+    manifest_entries = []
+    for url, content_length in entries:
+        entry = {"url": url, "mandatory": True}
+        if content_length is not None:
+            entry["meta"] = {"content_length": content_length}
+        manifest_entries.append(entry)
+    return json.dumps({"entries": manifest_entries}, indent=2)
+
+
+def write_manifest(s3, bucket, key, entries):
+    s3.put_object(Bucket=bucket, Key=key, Body=build_manifest(entries).encode("utf-8"))
+    return "s3://{}/{}".format(bucket, key)
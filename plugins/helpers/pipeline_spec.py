@@ -0,0 +1,114 @@
+"""
+Declarative spec of the crime and weather pipeline, shared by the monthly DAG and the range backfill DAG so the two
+cannot drift apart. helpers.dag_factory.build_dag wires the tasks from the datasets they read and write.
+"""
+from airflow.operators.python import BranchPythonOperator, PythonOperator
+from airflow.utils.trigger_rule import TriggerRule
+from operators.pull_weather_data import BigQueryToS3Operator
+from operators.pull_crime_data import SocrataToS3Operator
+from operators.data_quality import DataQualityOperator
+from operators.s3_to_staging_redshift import StageToRedshiftOperator
+from operators.load_fact import LoadFactOperator
+from operators.load_rollup import LoadRollupOperator
+from operators.load_dimensions_batch import BatchLoadDimensionOperator
+from operators.cleanup_staging import DropStagingTablesOperator
+from helpers.sql_queries import SqlQueries
+from helpers.change_detection import load_if_extracts_changed, record_loaded_extracts
+
+pull_task_ids = ['pull_crime_data_task', 'pull_weather_data_task']
+
+# [south, west, north, east] of the GSOD stations pulled for the city; every crime is joined to the weather of
+# its nearest station.
+weather_bbox = [41.5, -88.0, 42.1, -87.5]
+
+data_quality_checks = [
+    {'check_sql': "SELECT COUNT(*) FROM crime WHERE primary_type IS NULL", 'expected_result': 0},
+    {'check_sql': "SELECT COUNT(*) FROM crime_location WHERE block IS NULL", 'expected_result': 0},
+    {'check_sql': "SELECT COUNT(*) FROM crime_arrest", 'comparison': 'between', 'expected_result': [1, 2]},
+    {'check_sql': "SELECT COUNT(*) FROM crime_domestic", 'comparison': 'between', 'expected_result': [1, 2]},
+    {'check_sql': "SELECT COUNT(*) FROM time WHERE crime_time IS NULL", 'expected_result': 0},
+    {'check_sql': "SELECT COUNT(*) FROM daily_weather WHERE id IS NULL", 'expected_result': 0},
+    {'check_sql': SqlQueries.rollup_weekly_mismatches, 'expected_result': 0, 'interval': True},
+    {'check_sql': SqlQueries.rollup_monthly_mismatches, 'expected_result': 0, 'interval': True},
+    {'check_sql': SqlQueries.rollup_community_area_mismatches, 'expected_result': 0, 'interval': True},
+]
+
+
+def pipeline_spec(estimates, crime_kwargs=None, quality_checks=True):
+    """
+    Returns the task specs of the pipeline for helpers.dag_factory.build_dag.
+
+    Both pulls start at once and every source is staged by its own COPY once the pulls show a changed month; the
+    dimensions load beside the fact and the rollups follow the fact. The pools limit the tasks running against
+    each service across the active runs (see dags/support/pools.json).
+
+    Parameters
+    ----------
+    estimates : dict
+        task id to rough minutes per run, only feeding the critical path
+    crime_kwargs : dict
+        extra arguments of the crime pull, e.g. its concurrency
+    quality_checks : bool
+        run the data quality checks before the loaded extracts are recorded
+    """
+    spec = [
+        {'task_id': 'pull_crime_data_task', 'operator': SocrataToS3Operator, 'pool': 'socrata_pool',
+         'writes': ['s3/crime'],
+         'kwargs': dict({'aws_credentials_id': 'aws_connection', 'folder': 'crime', 'skip_unchanged': True,
+                         'bbox': weather_bbox,
+                         'paginate': True, 'page_size': 50000, 'provide_context': True}, **(crime_kwargs or {}))},
+        {'task_id': 'pull_weather_data_task', 'operator': BigQueryToS3Operator, 'pool': 'bigquery_pool',
+         'writes': ['s3/weather'],
+         'kwargs': {'aws_credentials_id': 'aws_connection', 'folder': 'weather', 'skip_unchanged': True,
+                    'bbox': weather_bbox,
+                    'provide_context': True}},
+        # Follows the staging COPYs only when a pull wrote a changed month, so re-running unchanged months costs no
+        # Redshift work. A COPY cannot be gated on its own source alone: the fact of a month whose weather changed
+        # still needs the run's crimes staged, and the loads wait for both COPYs anyway.
+        {'task_id': 'extracts_changed', 'operator': BranchPythonOperator,
+         'reads': ['s3/crime', 's3/weather'], 'writes': ['changed_extracts'],
+         'kwargs': {'python_callable': load_if_extracts_changed, 'op_kwargs': {'task_ids': pull_task_ids}}},
+        {'task_id': 's3_to_redshift_task_crime', 'operator': StageToRedshiftOperator, 'pool': 'redshift_pool',
+         'reads': ['changed_extracts', 's3/crime'], 'writes': ['staging_crimes'],
+         'kwargs': {'aws_credentials_id': 'aws_connection', 'redshift_conn_id': 'redshift_conn',
+                    'source_key': 'crime', 'target_table': 'staging_crimes',
+                    's3_bucket': 'udacitycapstoneprojectbucket', 'scoped_staging': True}},
+        {'task_id': 's3_to_redshift_task_weather', 'operator': StageToRedshiftOperator, 'pool': 'redshift_pool',
+         'reads': ['changed_extracts', 's3/weather'], 'writes': ['staging_weather'],
+         'kwargs': {'aws_credentials_id': 'aws_connection', 'redshift_conn_id': 'redshift_conn',
+                    'source_key': 'weather', 'target_table': 'staging_weather',
+                    's3_bucket': 'udacitycapstoneprojectbucket', 'scoped_staging': True}},
+        {'task_id': 'load_crime_weather_fact_table', 'operator': LoadFactOperator, 'pool': 'redshift_pool',
+         'reads': ['staging_crimes', 'staging_weather'], 'writes': ['fact_daily_crime_weather'],
+         'kwargs': {'redshift_conn_id': 'redshift_conn', 'target_table': 'fact_daily_crime_weather',
+                    'sql': SqlQueries.fact_daily_crime_weather_incremental_insert, 'incremental': True,
+                    'scoped_staging': True}},
+        {'task_id': 'load_dimension_tables', 'operator': BatchLoadDimensionOperator, 'pool': 'redshift_pool',
+         'reads': ['staging_crimes', 'staging_weather'], 'writes': ['dimensions'],
+         'kwargs': {'redshift_conn_id': 'redshift_conn', 'dimensions': SqlQueries.dimension_tables,
+                    'staging_projections': SqlQueries.dimension_staging_projections, 'scoped_staging': True}},
+        {'task_id': 'load_rollup_tables', 'operator': LoadRollupOperator, 'pool': 'redshift_pool',
+         'reads': ['fact_daily_crime_weather', 'staging_crimes'], 'writes': ['rollups'],
+         'kwargs': {'redshift_conn_id': 'redshift_conn', 'rollups': SqlQueries.rollup_tables,
+                    'scoped_staging': True}},
+        # Runs whatever happened upstream, so the run's staging tables never outlive it, not even a failed load.
+        {'task_id': 'drop_staging_tables', 'operator': DropStagingTablesOperator, 'pool': 'redshift_pool',
+         'drops': ['staging_crimes', 'staging_weather'],
+         'kwargs': {'redshift_conn_id': 'redshift_conn', 'trigger_rule': TriggerRule.ALL_DONE,
+                    'tables': ['staging_crimes', 'staging_weather']}},
+    ]
+    loaded = ['fact_daily_crime_weather', 'dimensions', 'rollups']
+    if quality_checks:
+        spec.append(
+            {'task_id': 'Run_data_quality_checks', 'operator': DataQualityOperator, 'pool': 'redshift_pool',
+             'reads': loaded, 'writes': ['quality_checked'],
+             'kwargs': {'redshift_conn_id': 'redshift_conn', 'dq_checks': data_quality_checks}})
+        loaded = ['quality_checked']
+    spec.append(
+        {'task_id': 'record_loaded_extracts', 'operator': PythonOperator, 'reads': loaded,
+         'kwargs': {'python_callable': record_loaded_extracts,
+                    'op_kwargs': {'aws_credentials_id': 'aws_connection', 'task_ids': pull_task_ids}}})
+    for task in spec:
+        if task['task_id'] in estimates:
+            task['estimate'] = estimates[task['task_id']]
+    return spec
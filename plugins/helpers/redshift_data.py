@@ -0,0 +1,85 @@
+"""
+Submission and polling of statements through the Redshift Data API, used by the deferrable Redshift operators
+and RedshiftStatementTrigger. The Data API runs the statements on the cluster without holding a connection, so
+the task can give its worker slot back while Redshift works.
+"""
+from urllib.parse import urlparse
+
+from airflow.hooks.base import BaseHook
+
+from helpers.clients import aws_client
+
+finished_statuses = ("FINISHED",)
+failed_statuses = ("FAILED", "ABORTED")
+
+
+def data_api_client(aws_credentials_id, region_name="us-west-2"):
+    return aws_client(aws_credentials_id, "redshift-data", region_name)
+
+
+def connection_target(redshift_conn_id, cluster_identifier=None, database=None, db_user=None):
+    """
+    Returns the ClusterIdentifier, Database and DbUser of the Data API calls. Values not given are read from the
+    Redshift connection: the cluster is the first label of the endpoint host, e.g. `mycluster` for
+    mycluster.abc123.us-west-2.redshift.amazonaws.com.
+    """
+    conn = BaseHook.get_connection(redshift_conn_id)
+    host = conn.host or ""
+    if "://" in host:
+        host = urlparse(host).hostname or ""
+    return {
+        "ClusterIdentifier": cluster_identifier or host.split(".")[0],
+        "Database": database or conn.schema,
+        "DbUser": db_user or conn.login,
+    }
+
+
+def submit_statements(client, target, statements, statement_name=None):
+    """Submits the statements, several of them as one transaction, and returns the statement id."""
+    options = dict(target, WithEvent=False)
+    if statement_name:
+        options["StatementName"] = statement_name[:500]
+    if len(statements) == 1:
+        return client.execute_statement(Sql=statements[0], **options)["Id"]
+    return client.batch_execute_statement(Sqls=list(statements), **options)["Id"]
+
+
+def statement_outcome(description):
+    """Summarizes a describe_statement response: status, duration, Redshift query ids, rows and error."""
+    sub_statements = description.get("SubStatements", [])
+    query_ids = [statement["RedshiftQueryId"] for statement in sub_statements if statement.get("RedshiftQueryId")]
+    if not sub_statements and description.get("RedshiftQueryId"):
+        query_ids = [description["RedshiftQueryId"]]
+    result_id = sub_statements[-1]["Id"] if sub_statements else description["Id"]
+    has_result_set = sub_statements[-1].get("HasResultSet") if sub_statements else description.get("HasResultSet")
+    return {
+        "statement_id": description["Id"],
+        "status": description["Status"],
+        # The Data API reports durations in nanoseconds
+        "duration_s": round(description.get("Duration", 0) / 1e9, 3),
+        "redshift_query_ids": query_ids,
+        "result_rows": description.get("ResultRows", -1),
+        "result_statement_id": result_id if has_result_set else None,
+        "error": description.get("Error"),
+    }
+
+
+def field_value(field):
+    if field.get("isNull"):
+        return None
+    for key in ("longValue", "doubleValue", "booleanValue", "stringValue", "blobValue"):
+        if key in field:
+            return field[key]
+    return None
+
+
+def fetch_records(client, statement_id):
+    """Returns the rows of a finished statement (or sub-statement) as tuples."""
+    records = []
+    options = {"Id": statement_id}
+    while True:
+        response = client.get_statement_result(**options)
+        records.extend(tuple(field_value(field) for field in row) for row in response["Records"])
+        if not response.get("NextToken"):
+            return records
+        options["NextToken"] = response["NextToken"]
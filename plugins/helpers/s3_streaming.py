@@ -0,0 +1,220 @@
+import hashlib
+import tempfile
+import zlib
+from contextlib import nullcontext
+
+
+class S3MultipartWriter:
+    """
+    File-like object that streams bytes into a single S3 object through a multipart upload.
+
+    Data is buffered only until a part is full, so memory stays bounded by the part size
+    regardless of the size of the object. Objects smaller than one part are sent with a
+    plain put_object call.
+
+    With skip_unchanged the data is spooled locally (spilling to disk past one part) while its
+    sha256 is computed, and it is only uploaded when the fingerprint differs from the one stored
+    in the metadata of the existing object.
+
+    Attributes
+    ----------
+    s3 : botocore client
+        boto3 S3 client
+    bucket : str
+        target S3 bucket
+    key : str
+        target S3 key
+    part_size : int
+        size of the parts sent to S3 (at least 5 MiB, the S3 minimum)
+    bytes_written : int
+        number of bytes accepted by the writer so far
+    skip_unchanged : bool
+        skip the upload when the existing object has the same content fingerprint
+    changed : bool
+        whether the object was uploaded, known once the writer is closed
+    metrics : OperatorMetrics
+        optional metrics of the operator; the S3 calls are timed as its "upload" phase
+
+    Methods
+    -------
+    write(data):
+        Buffers the data and uploads every full part.
+    fingerprint():
+        Returns the sha256 hex digest of the data written so far.
+    close():
+        Uploads the remaining data and completes the upload.
+    abort():
+        Aborts the multipart upload and discards the uploaded parts.
+    """
+
+    min_part_size = 5 * 1024 * 1024
+
+    fingerprint_metadata_key = "content-sha256"
+
+    def __init__(self, s3, bucket, key, part_size=8 * 1024 * 1024, skip_unchanged=False, metrics=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = max(part_size, S3MultipartWriter.min_part_size)
+        self.skip_unchanged = skip_unchanged
+        self.bytes_written = 0
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.metadata = {}
+        self.digest = hashlib.sha256()
+        self.spool = tempfile.SpooledTemporaryFile(max_size=self.part_size) if skip_unchanged else None
+        self.changed = None
+        self.metrics = metrics
+        self.closed = False
+
+    def upload_phase(self):
+        return self.metrics.phase("upload") if self.metrics is not None else nullcontext()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.digest.update(data)
+        self.bytes_written += len(data)
+        if self.spool is not None:
+            self.spool.write(data)
+        else:
+            self._buffer(data)
+        return len(data)
+
+    def fingerprint(self):
+        return self.digest.hexdigest()
+
+    def existing_fingerprint(self):
+        """Returns the fingerprint stored in the metadata of the existing object, None if there is no object."""
+        from botocore.exceptions import ClientError
+        try:
+            with self.upload_phase():
+                response = self.s3.head_object(Bucket=self.bucket, Key=self.key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response.get("Metadata", {}).get(S3MultipartWriter.fingerprint_metadata_key)
+
+    def _buffer(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+
+    def _upload_part(self, body):
+        with self.upload_phase():
+            if self.upload_id is None:
+                response = self.s3.create_multipart_upload(Bucket=self.bucket, Key=self.key, Metadata=self.metadata)
+                self.upload_id = response["UploadId"]
+            part_number = len(self.parts) + 1
+            response = self.s3.upload_part(Bucket=self.bucket,
+                                           Key=self.key,
+                                           UploadId=self.upload_id,
+                                           PartNumber=part_number,
+                                           Body=body)
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+
+    def close(self):
+        if self.closed:
+            return
+        if self.spool is not None:
+            if self.existing_fingerprint() == self.fingerprint():
+                self.spool.close()
+                self.changed = False
+                self.closed = True
+                return
+            self.metadata = {S3MultipartWriter.fingerprint_metadata_key: self.fingerprint()}
+            self.spool.seek(0)
+            for chunk in iter(lambda: self.spool.read(self.part_size), b""):
+                self._buffer(chunk)
+            self.spool.close()
+        if self.upload_id is None:
+            with self.upload_phase():
+                self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), Metadata=self.metadata)
+        else:
+            if self.buffer:
+                self._upload_part(bytes(self.buffer))
+            with self.upload_phase():
+                self.s3.complete_multipart_upload(Bucket=self.bucket,
+                                                  Key=self.key,
+                                                  UploadId=self.upload_id,
+                                                  MultipartUpload={"Parts": self.parts})
+        self.buffer = bytearray()
+        self.changed = True
+        self.closed = True
+
+    def abort(self):
+        if self.upload_id is not None:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        if self.spool is not None:
+            self.spool.close()
+        self.buffer = bytearray()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GzipWriter:
+    """
+    File-like wrapper gzip compressing everything written to it into another writer, e.g. an S3MultipartWriter.
+
+    Attributes
+    ----------
+    fileobj : file-like
+        binary sink receiving the compressed stream
+    bytes_in : int
+        number of uncompressed bytes written so far
+    """
+
+    def __init__(self, fileobj, level=6):
+        self.fileobj = fileobj
+        self.bytes_in = 0
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_in
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bytes_in += len(data)
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self.fileobj.write(compressed)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.fileobj.write(self.compressor.flush())
+        self.fileobj.close()
+        self.closed = True
+
+    def abort(self):
+        self.fileobj.abort()
+        self.closed = True
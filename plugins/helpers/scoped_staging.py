@@ -0,0 +1,24 @@
+import re
+
+
+# Permanent staging tables from dags/support/create_tables.sql. In scoped mode they only serve as the
+# template of the per-run tables, which are created LIKE them and so keep their distribution and sort keys.
+staging_tables = ("staging_crimes", "staging_weather")
+
+staging_table_pattern = re.compile(r"\b({})\b".format("|".join(staging_tables)))
+
+
+def run_suffix(context):
+    """Suffix identifying the data interval of a run, e.g. 20010101_20010201."""
+    return "{}_{}".format(context["data_interval_start"].strftime('%Y%m%d'),
+                          context["data_interval_end"].strftime('%Y%m%d'))
+
+
+def scoped_table_name(table, context):
+    return "{}_{}".format(table, run_suffix(context))
+
+
+def scope_sql(sql, context):
+    """Rewrites every reference to a staging table into the staging table of the run's data interval."""
+    suffix = run_suffix(context)
+    return staging_table_pattern.sub(lambda match: "{}_{}".format(match.group(1), suffix), sql)
@@ -0,0 +1,164 @@
+"""
+Asynchronous Socrata client used by SocrataToS3Operator to keep many page requests in flight at once.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+
+import aiohttp
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate of the app token.
+
+    Attributes
+    ----------
+    rate : float
+        tokens added per second, None disables the limit
+    capacity : float
+        maximum number of tokens, i.e. the largest burst
+
+    Methods
+    -------
+    acquire():
+        Waits until a token is available and takes it.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(rate or 1, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncSocrataClient:
+    """
+    Issues SoQL queries against a Socrata domain with a bounded number of concurrent requests.
+
+    Requests wait for a token of the rate limiter and are retried with full jitter exponential backoff on
+    429 and 5xx responses and on connection errors; a numeric Retry-After header is honoured.
+
+    Attributes
+    ----------
+    base_url : str
+        Socrata domain URL, e.g. https://data.cityofchicago.org, or the URL of a local fake server
+    app_token : str
+        Socrata app token sent as X-App-Token
+    concurrency : int
+        maximum number of requests in flight
+    requests_per_second : float
+        sustained request rate allowed by the token bucket, None for no limit
+    max_retries : int
+        number of retries of a failing request before the error is raised
+    backoff : float
+        base delay in seconds of the exponential backoff
+
+    Methods
+    -------
+    get(dataset, query):
+        Returns the rows of a SoQL query.
+    count(dataset, where):
+        Returns the number of rows matching a SoQL where clause.
+    ordered(dataset, queries):
+        Async generator running the queries with up to `concurrency` in flight and yielding the results in order.
+    """
+
+    retry_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url, app_token=None, concurrency=8, requests_per_second=None, max_retries=5,
+                 backoff=0.5, max_backoff=30, timeout=60):
+        self.base_url = base_url.rstrip("/")
+        self.app_token = app_token
+        self.concurrency = max(int(concurrency), 1)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.requests_per_second = requests_per_second
+        self.session = None
+        self.rate_limiter = None
+        self.semaphore = None
+        self.request_count = 0
+        self.retry_count = 0
+
+    async def __aenter__(self):
+        headers = {"X-App-Token": self.app_token} if self.app_token else {}
+        self.session = aiohttp.ClientSession(headers=headers,
+                                             timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.rate_limiter = TokenBucket(self.requests_per_second)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.session.close()
+
+    def resource_url(self, dataset):
+        return "{}/resource/{}.json".format(self.base_url, dataset)
+
+    def retry_delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after is not None and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+        return delay
+
+    async def get(self, dataset, query):
+        attempt = 0
+        while True:
+            retry_after = None
+            async with self.semaphore:
+                await self.rate_limiter.acquire()
+                self.request_count += 1
+                try:
+                    async with self.session.get(self.resource_url(dataset), params={"$query": query}) as response:
+                        if response.status not in AsyncSocrataClient.retry_statuses:
+                            response.raise_for_status()
+                            return await response.json()
+                        retry_after = response.headers.get("Retry-After")
+                        error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                            status=response.status, message=response.reason)
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as connection_error:
+                    error = connection_error
+            if attempt >= self.max_retries:
+                raise error
+            self.retry_count += 1
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+            attempt += 1
+
+    async def count(self, dataset, where):
+        rows = await self.get(dataset, "select count(*) as row_count where {}".format(where))
+        return int(rows[0]["row_count"]) if rows else 0
+
+    async def ordered(self, dataset, queries):
+        """Keeps a window of `concurrency` queries running ahead of the consumer, so results arrive in order."""
+        window = deque()
+        queries = iter(queries)
+        try:
+            for query in queries:
+                window.append(asyncio.ensure_future(self.get(dataset, query)))
+                if len(window) >= self.concurrency:
+                    break
+            while window:
+                result = await window.popleft()
+                for query in queries:
+                    window.append(asyncio.ensure_future(self.get(dataset, query)))
+                    break
+                yield result
+        finally:
+            for task in window:
+                task.cancel()
@@ -1,19 +1,59 @@
 class SqlQueries:
+    # Weather per station and day, plus a row per day for the `city` station (helpers.stations.city_station) of
+    # the crimes without a location, averaging the temperature and wind of all stations and flagging the weather
+    # seen at any of them.
+    station_weather = ("""(
+                    SELECT weather_date, station, temp, windspeed, fog::int AS fog, rain_drizzle::int AS rain_drizzle,
+                           snow_ice_pellets::int AS snow_ice_pellets, thunder::int AS thunder
+                    FROM staging_weather
+                    UNION ALL
+                    SELECT weather_date, 'city', AVG(temp), AVG(windspeed), MAX(fog::int), MAX(rain_drizzle::int),
+                           MAX(snow_ice_pellets::int), MAX(thunder::int)
+                    FROM staging_weather
+                    GROUP BY weather_date
+                    ) AS weather""")
+
+    # The fact queries join weather on its weather_date DATE column, written by the weather pull, so the join is a
+    # plain date equality on the sort key of staging_weather. Every crime carries its nearest weather station, or
+    # the city station, so the fact has one row per day and station, joined to the weather of that station.
     fact_daily_crime_weather_insert = ("""SELECT
 					TRUNC(staging_crimes.crime_date) as crime_date,
+                    staging_crimes.station,
+                    count(staging_crimes.*) as crime_count,
+                    SUM(CASE WHEN staging_crimes.arrest IS TRUE THEN 1 ELSE 0 END) as arrest_count,
+                    SUM(CASE WHEN staging_crimes.domestic IS TRUE THEN 1 ELSE 0 END) as domestic_count,
+                    AVG(weather.temp) as temp,
+                    AVG(weather.windspeed) as windspeed,
+                    MAX(weather.fog) as fog,
+                    MAX(weather.rain_drizzle) as rain_drizzle,
+                    MAX(weather.snow_ice_pellets) as snow_ice_pellets,
+                    MAX(weather.thunder) as thunder
+                    FROM staging_crimes
+                    LEFT JOIN """ + station_weather + """ ON TRUNC(staging_crimes.crime_date) = weather.weather_date
+                                             AND staging_crimes.station = weather.station
+                    GROUP BY TRUNC(staging_crimes.crime_date), staging_crimes.station
+                    ORDER BY TRUNC(staging_crimes.crime_date), staging_crimes.station
+            """)
+
+    # Same aggregation restricted to one data interval, formatted with {start} and {end} dates.
+    fact_daily_crime_weather_incremental_insert = ("""SELECT
+                    TRUNC(staging_crimes.crime_date) as crime_date,
+                    staging_crimes.station,
                     count(staging_crimes.*) as crime_count,
                     SUM(CASE WHEN staging_crimes.arrest IS TRUE THEN 1 ELSE 0 END) as arrest_count,
                     SUM(CASE WHEN staging_crimes.domestic IS TRUE THEN 1 ELSE 0 END) as domestic_count,
-                    AVG(staging_weather.temp) as temp,
-                    AVG(staging_weather.windspeed) as windspeed,
-                    MAX(staging_weather.fog::int) as fog,
-                    MAX(staging_weather.rain_drizzle::int) as rain_drizzle,
-                    MAX(staging_weather.snow_ice_pellets::int) as snow_ice_pellets,
-                    MAX(staging_weather.thunder::int) as thunder
+                    AVG(weather.temp) as temp,
+                    AVG(weather.windspeed) as windspeed,
+                    MAX(weather.fog) as fog,
+                    MAX(weather.rain_drizzle) as rain_drizzle,
+                    MAX(weather.snow_ice_pellets) as snow_ice_pellets,
+                    MAX(weather.thunder) as thunder
                     FROM staging_crimes
-                    LEFT JOIN staging_weather ON TRUNC(staging_crimes.crime_date) = (staging_weather.year::text || '-' || staging_weather.month::text || '-' || staging_weather.day::text)::date
-                    GROUP BY TRUNC(staging_crimes.crime_date)
-                    ORDER BY TRUNC(staging_crimes.crime_date)
+                    LEFT JOIN """ + station_weather + """ ON TRUNC(staging_crimes.crime_date) = weather.weather_date
+                                             AND staging_crimes.station = weather.station
+                    WHERE staging_crimes.crime_date >= '{start}' AND staging_crimes.crime_date < '{end}'
+                    GROUP BY TRUNC(staging_crimes.crime_date), staging_crimes.station
+                    ORDER BY TRUNC(staging_crimes.crime_date), staging_crimes.station
             """)
 
 
@@ -39,16 +79,178 @@ class SqlQueries:
         """)
 
     dim_table_time_insert = ("""
-                SELECT crime_date, 
-                       extract(hour FROM crime_date), 
-                       extract(day FROM crime_date), 
-                       extract(week FROM crime_date),
-                       extract(year FROM crime_date),
-                       extract(dayofweek FROM crime_date)
+                SELECT crime_date AS crime_time,
+                       extract(hour FROM crime_date) AS "hour",
+                       extract(day FROM crime_date) AS "day",
+                       extract(week FROM crime_date) AS week,
+                       extract(year FROM crime_date) AS "year",
+                       extract(dayofweek FROM crime_date) AS weekday
                 FROM staging_crimes
     """)
 
     dim_table_daily_weather_insert = ("""
                 SELECT * 
                 FROM staging_weather
-    """)
\ No newline at end of file
+    """)
+    # Columns of the staging tables read by the dimension queries. The batched dimension loader copies this
+    # projection into session temp tables once and runs every dimension query against it.
+    dimension_staging_projections = {
+        "staging_crimes": ["crime_date", "block", "primary_type", "arrest", "domestic",
+                           "district", "ward", "community_area"],
+        "staging_weather": ["*"],
+    }
+
+    dimension_tables = [
+        {"target_table": "crime", "sql": dim_table_crime_insert, "primary_key": ["primary_type"]},
+        {"target_table": "crime_location", "sql": dim_table_crime_location_insert, "primary_key": ["block"]},
+        {"target_table": "crime_arrest", "sql": dim_table_crime_arrest_insert, "primary_key": ["arrest"]},
+        {"target_table": "crime_domestic", "sql": dim_table_crime_domestic_insert, "primary_key": ["domestic"]},
+        {"target_table": "time", "sql": dim_table_time_insert, "primary_key": ["crime_time"]},
+        {"target_table": "daily_weather", "sql": dim_table_daily_weather_insert,
+         "primary_key": ["station", "year", "month", "day"]},
+    ]
+
+    # Rollups maintained by LoadRollupOperator. Each SELECT is formatted with the {start} and {end} dates of whole
+    # partitions, so the weekly and monthly rollups re-aggregate complete periods of the fact table. The fact has a
+    # row per station and day, so days are counted distinct and a weather day is a day it was seen at any station.
+    rollup_crime_weather_weekly_insert = ("""
+                SELECT DATE_TRUNC('week', crime_date)::date AS week_start,
+                       COUNT(DISTINCT crime_date) AS days,
+                       SUM(crime_count) AS crime_count,
+                       SUM(arrest_count) AS arrest_count,
+                       SUM(domestic_count) AS domestic_count,
+                       AVG(temp) AS temp,
+                       AVG(windspeed) AS windspeed,
+                       COUNT(DISTINCT CASE WHEN fog THEN crime_date END) AS fog_days,
+                       COUNT(DISTINCT CASE WHEN rain_drizzle THEN crime_date END) AS rain_drizzle_days,
+                       COUNT(DISTINCT CASE WHEN snow_ice_pellets THEN crime_date END) AS snow_ice_pellets_days,
+                       COUNT(DISTINCT CASE WHEN thunder THEN crime_date END) AS thunder_days
+                FROM fact_daily_crime_weather
+                WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                GROUP BY DATE_TRUNC('week', crime_date)::date
+    """)
+
+    rollup_crime_weather_monthly_insert = ("""
+                SELECT DATE_TRUNC('month', crime_date)::date AS month_start,
+                       COUNT(DISTINCT crime_date) AS days,
+                       SUM(crime_count) AS crime_count,
+                       SUM(arrest_count) AS arrest_count,
+                       SUM(domestic_count) AS domestic_count,
+                       AVG(temp) AS temp,
+                       AVG(windspeed) AS windspeed,
+                       COUNT(DISTINCT CASE WHEN fog THEN crime_date END) AS fog_days,
+                       COUNT(DISTINCT CASE WHEN rain_drizzle THEN crime_date END) AS rain_drizzle_days,
+                       COUNT(DISTINCT CASE WHEN snow_ice_pellets THEN crime_date END) AS snow_ice_pellets_days,
+                       COUNT(DISTINCT CASE WHEN thunder THEN crime_date END) AS thunder_days
+                FROM fact_daily_crime_weather
+                WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                GROUP BY DATE_TRUNC('month', crime_date)::date
+    """)
+
+    # Crimes per community area and day, with the weather taken from the fact rows of the crimes' nearest stations:
+    # averaged over the crimes, and a weather flag is set when it was seen at any of their stations.
+    rollup_community_area_daily_insert = ("""
+                SELECT TRUNC(staging_crimes.crime_date) AS crime_date,
+                       staging_crimes.community_area,
+                       COUNT(*) AS crime_count,
+                       SUM(CASE WHEN staging_crimes.arrest IS TRUE THEN 1 ELSE 0 END) AS arrest_count,
+                       SUM(CASE WHEN staging_crimes.domestic IS TRUE THEN 1 ELSE 0 END) AS domestic_count,
+                       AVG(fact_daily_crime_weather.temp) AS temp,
+                       AVG(fact_daily_crime_weather.windspeed) AS windspeed,
+                       BOOL_OR(fact_daily_crime_weather.fog) AS fog,
+                       BOOL_OR(fact_daily_crime_weather.rain_drizzle) AS rain_drizzle,
+                       BOOL_OR(fact_daily_crime_weather.snow_ice_pellets) AS snow_ice_pellets,
+                       BOOL_OR(fact_daily_crime_weather.thunder) AS thunder
+                FROM staging_crimes
+                LEFT JOIN fact_daily_crime_weather
+                       ON TRUNC(staging_crimes.crime_date) = fact_daily_crime_weather.crime_date
+                      AND staging_crimes.station = fact_daily_crime_weather.station
+                WHERE staging_crimes.crime_date >= '{start}' AND staging_crimes.crime_date < '{end}'
+                GROUP BY TRUNC(staging_crimes.crime_date), staging_crimes.community_area
+    """)
+
+    rollup_tables = [
+        {"target_table": "crime_weather_weekly", "period_column": "week_start", "grain": "week",
+         "sql": rollup_crime_weather_weekly_insert},
+        {"target_table": "crime_weather_monthly", "period_column": "month_start", "grain": "month",
+         "sql": rollup_crime_weather_monthly_insert},
+        {"target_table": "crime_community_area_daily", "period_column": "crime_date", "grain": "day",
+         "sql": rollup_community_area_daily_insert},
+    ]
+
+    # Data quality checks counting the periods where a rollup disagrees with the fact table; all expect 0. They are
+    # formatted with the {start} and {end} dates of the run's data interval and only compare the periods lying
+    # wholly inside it: a week straddling two monthly runs may be rebuilt by the next run while this one is checked,
+    # so it is left out, and runs never scan the whole fact table. The data intervals start on the first of a month.
+    rollup_weekly_mismatches = ("""
+                SELECT COUNT(*)
+                FROM (
+                    SELECT week_start, crime_count, arrest_count, domestic_count
+                    FROM crime_weather_weekly
+                    WHERE week_start >= '{start}' AND week_start + 7 <= '{end}'
+                ) AS rollup_rows
+                FULL OUTER JOIN (
+                    SELECT DATE_TRUNC('week', crime_date)::date AS week_start,
+                           SUM(crime_count) AS crime_count,
+                           SUM(arrest_count) AS arrest_count,
+                           SUM(domestic_count) AS domestic_count
+                    FROM fact_daily_crime_weather
+                    WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                    GROUP BY DATE_TRUNC('week', crime_date)::date
+                    HAVING DATE_TRUNC('week', crime_date)::date >= '{start}'
+                       AND DATE_TRUNC('week', crime_date)::date + 7 <= '{end}'
+                ) AS fact_rows ON rollup_rows.week_start = fact_rows.week_start
+                WHERE rollup_rows.week_start IS NULL OR fact_rows.week_start IS NULL
+                   OR rollup_rows.crime_count <> fact_rows.crime_count
+                   OR rollup_rows.arrest_count <> fact_rows.arrest_count
+                   OR rollup_rows.domestic_count <> fact_rows.domestic_count
+    """)
+
+    rollup_monthly_mismatches = ("""
+                SELECT COUNT(*)
+                FROM (
+                    SELECT month_start, crime_count, arrest_count, domestic_count
+                    FROM crime_weather_monthly
+                    WHERE month_start >= '{start}' AND month_start < '{end}'
+                ) AS rollup_rows
+                FULL OUTER JOIN (
+                    SELECT DATE_TRUNC('month', crime_date)::date AS month_start,
+                           SUM(crime_count) AS crime_count,
+                           SUM(arrest_count) AS arrest_count,
+                           SUM(domestic_count) AS domestic_count
+                    FROM fact_daily_crime_weather
+                    WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                    GROUP BY DATE_TRUNC('month', crime_date)::date
+                ) AS fact_rows ON rollup_rows.month_start = fact_rows.month_start
+                WHERE rollup_rows.month_start IS NULL OR fact_rows.month_start IS NULL
+                   OR rollup_rows.crime_count <> fact_rows.crime_count
+                   OR rollup_rows.arrest_count <> fact_rows.arrest_count
+                   OR rollup_rows.domestic_count <> fact_rows.domestic_count
+    """)
+
+    # Only the days present in the community area rollup are compared, it is built from the detailed crime pull.
+    rollup_community_area_mismatches = ("""
+                SELECT COUNT(*)
+                FROM (
+                    SELECT crime_date,
+                           SUM(crime_count) AS crime_count,
+                           SUM(arrest_count) AS arrest_count,
+                           SUM(domestic_count) AS domestic_count
+                    FROM crime_community_area_daily
+                    WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                    GROUP BY crime_date
+                ) AS rollup_rows
+                LEFT JOIN (
+                    SELECT crime_date,
+                           SUM(crime_count) AS crime_count,
+                           SUM(arrest_count) AS arrest_count,
+                           SUM(domestic_count) AS domestic_count
+                    FROM fact_daily_crime_weather
+                    WHERE crime_date >= '{start}' AND crime_date < '{end}'
+                    GROUP BY crime_date
+                ) AS fact_rows ON rollup_rows.crime_date = fact_rows.crime_date
+                WHERE fact_rows.crime_date IS NULL
+                   OR rollup_rows.crime_count <> fact_rows.crime_count
+                   OR rollup_rows.arrest_count <> fact_rows.arrest_count
+                   OR rollup_rows.domestic_count <> fact_rows.domestic_count
+    """)
@@ -0,0 +1,260 @@
+import hashlib
+from contextlib import nullcontext
+
+from helpers.s3_streaming import S3MultipartWriter, GzipWriter
+from helpers.manifest import write_manifest
+
+
+file_extensions = {
+    "csv": "csv",
+    "parquet": "parquet",
+}
+
+# Column layout of the staging tables in dags/support/create_tables.sql.
+# Every entry is (staging column, source column, arrow type alias); COPY ... FORMAT AS PARQUET maps columns by
+# position. The types are aliases so pyarrow is only imported when a file is written, not when a DAG is parsed.
+staging_schemas = {
+    "crime": [
+        ("id", None, "int32"),
+        ("crime_date", "date", "timestamp[us]"),
+        ("block", "block", "string"),
+        ("primary_type", "primary_type", "string"),
+        ("description", "description", "string"),
+        ("arrest", "arrest", "bool"),
+        ("domestic", "domestic", "bool"),
+        ("district", "district", "int32"),
+        ("ward", "ward", "int32"),
+        ("community_area", "community_area", "int32"),
+        ("latitude", "latitude", "float64"),
+        ("longitude", "longitude", "float64"),
+        # Nearest weather station, assigned by SocrataToS3Operator from the GSOD stations of its bbox.
+        ("station", "station", "string"),
+    ],
+    "weather": [
+        ("id", None, "int32"),
+        ("year", "year", "int32"),
+        ("month", "mo", "int32"),
+        ("day", "da", "int32"),
+        ("temp", "temp", "float64"),
+        ("windspeed", "wdsp", "float64"),
+        ("fog", "fog", "bool"),
+        ("rain_drizzle", "rain_drizzle", "bool"),
+        ("snow_ice_pellets", "snow_ice_pellets", "bool"),
+        ("thunder", "thunder", "bool"),
+        ("weather_date", "weather_date", "date32"),
+        ("station", "station", "string"),
+        ("latitude", "latitude", "float64"),
+        ("longitude", "longitude", "float64"),
+    ],
+}
+
+
+def staging_key(folder, year, month, data_format="csv"):
+    """Returns the S3 key of the monthly extract of a source folder."""
+    if data_format not in file_extensions:
+        raise ValueError("Unsupported staging format: {}".format(data_format))
+    return "{}/{}-{}.{}".format(folder, year, month, file_extensions[data_format])
+
+
+def part_key(folder, year, month, part, data_format="csv", compress=False):
+    """Returns the S3 key of one part of a monthly extract split for a parallel COPY."""
+    return "{}/{}-{}/part-{:04d}.{}{}".format(folder, year, month, part, file_extensions[data_format],
+                                             ".gz" if compress else "")
+
+
+def manifest_key(folder, year, month):
+    """Returns the S3 key of the COPY manifest listing the parts of a monthly extract."""
+    return "{}/{}-{}.manifest".format(folder, year, month)
+
+
+def loaded_marker_key(folder, year, month):
+    """Returns the S3 key of the marker holding the fingerprint of the monthly extract last loaded into Redshift."""
+    return "{}/{}-{}.loaded".format(folder, year, month)
+
+
+def arrow_schema(schema_name):
+    import pyarrow as pa
+    return pa.schema([(column, pa.type_for_alias(alias)) for column, _, alias in staging_schemas[schema_name]])
+
+
+def _to_bool(series):
+    return series.astype(str).str.lower().map({"true": True, "false": False, "1": True, "0": False})
+
+
+def to_arrow_table(df, schema_name, first_id=0):
+    """
+    Converts an extracted DataFrame into a typed arrow table laid out like the staging table.
+    The id column is a running row number starting at first_id, like the index written by the CSV path.
+    """
+    import pandas as pd
+    import pyarrow as pa
+    arrays = []
+    for column, source, alias in staging_schemas[schema_name]:
+        arrow_type = pa.type_for_alias(alias)
+        if source is None:
+            values = pd.Series(range(first_id, first_id + len(df)))
+        elif source not in df:
+            values = pd.Series([None] * len(df), dtype="object")
+        elif pa.types.is_boolean(arrow_type):
+            values = _to_bool(df[source])
+        elif pa.types.is_integer(arrow_type):
+            values = pd.to_numeric(df[source], errors="coerce").astype("Int64")
+        elif pa.types.is_floating(arrow_type):
+            values = pd.to_numeric(df[source], errors="coerce")
+        elif pa.types.is_timestamp(arrow_type):
+            values = pd.to_datetime(df[source], errors="coerce")
+        elif pa.types.is_date(arrow_type):
+            values = pd.to_datetime(df[source], errors="coerce").dt.date
+        else:
+            values = df[source].astype("object").where(df[source].notna(), None)
+        arrays.append(pa.Array.from_pandas(values.reset_index(drop=True), type=arrow_type))
+    return pa.Table.from_arrays(arrays, schema=arrow_schema(schema_name))
+
+
+def write_parquet(df, schema_name, fileobj, compression="snappy"):
+    """Writes a whole extract as a single compressed parquet file."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    pq.write_table(to_arrow_table(df, schema_name), pa.PythonFile(fileobj, mode="w"), compression=compression)
+
+
+class ParquetPageWriter:
+    """
+    Writes a sequence of extracted pages into one parquet file, one row group per page.
+
+    Attributes
+    ----------
+    schema_name : str
+        key of staging_schemas describing the target staging table
+    fileobj : file-like
+        binary sink, e.g. an S3MultipartWriter
+    compression : str
+        parquet compression codec
+    row_count : int
+        number of rows written so far
+
+    Methods
+    -------
+    write_page(df, first_id):
+        Converts the page and appends it as a row group, numbering the ids from first_id.
+    close():
+        Writes the parquet footer.
+    """
+
+    def __init__(self, schema_name, fileobj, compression="snappy"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.schema_name = schema_name
+        self.row_count = 0
+        self.writer = pq.ParquetWriter(pa.PythonFile(fileobj, mode="w"),
+                                       arrow_schema(schema_name),
+                                       compression=compression)
+
+    def write_page(self, df, first_id=None):
+        first_id = self.row_count if first_id is None else first_id
+        self.writer.write_table(to_arrow_table(df, self.schema_name, first_id=first_id))
+        self.row_count += len(df)
+
+    def close(self):
+        self.writer.close()
+
+
+class MonthPartWriters:
+    """
+    Opens the S3 output of one monthly extract.
+
+    With a single uncompressed part the extract is written to its usual key. Otherwise it is split into
+    num_parts objects, optionally gzip compressed, and a COPY manifest listing them is written on close,
+    so Redshift can load the parts on all slices in parallel.
+
+    With skip_unchanged every part is only uploaded when its content fingerprint differs from the existing
+    object; the small manifest is always rewritten.
+
+    Attributes
+    ----------
+    num_parts : int
+        number of objects the extract is split into
+    keys : list
+        S3 keys of the parts
+    writers : list
+        file-like writers of the parts
+    manifest_key : str
+        S3 key of the manifest, None when the extract is a single object
+    changed : bool
+        whether any part was uploaded, known once the writers are closed
+    metrics : OperatorMetrics
+        optional metrics of the operator, receiving the upload timings and the bytes_written and bytes_uploaded
+        counters
+
+    Methods
+    -------
+    fingerprint():
+        Returns the sha256 hex digest of the whole extract, combining the fingerprints of the parts.
+    close():
+        Completes every part upload and writes the manifest.
+    abort():
+        Aborts every part upload.
+    """
+
+    def __init__(self, s3, bucket, folder, year, month, num_parts=1, data_format="csv", compress=False,
+                 skip_unchanged=False, metrics=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.num_parts = max(int(num_parts), 1)
+        if self.num_parts == 1 and not compress:
+            self.keys = [staging_key(folder, year, month, data_format)]
+            self.manifest_key = None
+        else:
+            self.keys = [part_key(folder, year, month, part, data_format, compress) for part in range(self.num_parts)]
+            self.manifest_key = manifest_key(folder, year, month)
+        self.metrics = metrics
+        self.uploads = [S3MultipartWriter(s3, bucket, key, skip_unchanged=skip_unchanged, metrics=metrics)
+                        for key in self.keys]
+        self.writers = [GzipWriter(upload) if compress else upload for upload in self.uploads]
+        self.changed = None
+
+    def fingerprint(self):
+        digest = hashlib.sha256()
+        for key, upload in zip(self.keys, self.uploads):
+            digest.update("{}:{}\n".format(key, upload.fingerprint()).encode("utf-8"))
+        return digest.hexdigest()
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.changed = any(upload.changed for upload in self.uploads)
+        if self.manifest_key is not None:
+            entries = [("s3://{}/{}".format(self.bucket, upload.key), upload.bytes_written) for upload in self.uploads]
+            with self.metrics.phase("upload") if self.metrics is not None else nullcontext():
+                write_manifest(self.s3, self.bucket, self.manifest_key, entries)
+        if self.metrics is not None:
+            self.metrics.count("bytes_written", sum(upload.bytes_written for upload in self.uploads))
+            self.metrics.count("bytes_uploaded", sum(upload.bytes_written for upload in self.uploads if upload.changed))
+
+    def abort(self):
+        for upload in self.uploads:
+            upload.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_frame(df, parts, schema_name, data_format="csv"):
+    """Splits an extracted DataFrame into similar-sized row ranges and writes one range per part."""
+    bounds = [len(df) * part // parts.num_parts for part in range(parts.num_parts + 1)]
+    for part, writer in enumerate(parts.writers):
+        chunk = df.iloc[bounds[part]:bounds[part + 1]]
+        if data_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(to_arrow_table(chunk, schema_name, first_id=bounds[part]),
+                           pa.PythonFile(writer, mode="w"),
+                           compression="snappy")
+        else:
+            writer.write(chunk.to_csv())
@@ -0,0 +1,463 @@
+"""
+Local stand-ins for the external services used by the operators, so the pipeline can be exercised offline.
+"""
+import asyncio
+import calendar
+import itertools
+import json
+import numbers
+import random
+import re
+import threading
+import time
+import uuid
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pandas as pd
+
+
+SchemaField = namedtuple("SchemaField", ["name"])
+
+
+# (USAF, WBAN, latitude, longitude) of GSOD stations around Chicago: Midway, O'Hare, Meigs Field and Lansing.
+gsod_stations = [
+    ("725340", "14819", 41.786, -87.752),
+    ("725300", "94846", 41.995, -87.934),
+    ("725346", "94866", 41.867, -87.607),
+    ("725337", "04879", 41.535, -87.529),
+]
+
+
+def synthetic_gsod_year(year, stations=None, seed=0):
+    """
+    Returns one synthetic GSOD row per station and day of the year, with the string typed columns of the public
+    dataset joined to the station's `station` id and coordinates.
+    """
+    rows = []
+    for usaf, wban, latitude, longitude in stations or gsod_stations:
+        rows.extend(synthetic_gsod_station_year(year, usaf, wban, latitude, longitude, seed))
+    return pd.DataFrame(rows)
+
+
+def synthetic_gsod_station_year(year, usaf, wban, latitude, longitude, seed=0):
+    rng = random.Random("{}-{}-{}".format(seed, year, usaf))
+    rows = []
+    for month in range(1, 13):
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            rows.append({
+                "stn": usaf,
+                "wban": wban,
+                "station": "{}-{}".format(usaf, wban),
+                "latitude": latitude,
+                "longitude": longitude,
+                "year": str(year),
+                "mo": "{:02d}".format(month),
+                "da": "{:02d}".format(day),
+                "temp": round(rng.uniform(-10, 90), 1),
+                "wdsp": "{:.1f}".format(rng.uniform(0, 25)),
+                "fog": rng.choice(["0", "1"]),
+                "rain_drizzle": rng.choice(["0", "1"]),
+                "snow_ice_pellets": rng.choice(["0", "1", "10"]),
+                "thunder": rng.choice(["0", "1", "10", "1000"]),
+            })
+    return rows
+
+
+def synthetic_crime_records(year, month, rows, seed=0):
+    """
+    Returns synthetic crime records of one month shaped like the Socrata JSON response, with :id and id. One in a
+    hundred records has no location, and Socrata leaves its latitude and longitude out.
+    """
+    rng = random.Random("{}-{}-{}".format(seed, year, month))
+    days = calendar.monthrange(year, month)[1]
+    primary_types = ["THEFT", "BATTERY", "CRIMINAL DAMAGE", "NARCOTICS", "ASSAULT", "BURGLARY", "ROBBERY"]
+    records = []
+    for row in range(rows):
+        records.append({
+            ":id": "row-{:012d}".format(row),
+            "id": str(row + 1),
+            "date": "{}-{:02d}-{:02d}T{:02d}:{:02d}:00.000".format(
+                year, month, rng.randint(1, days), rng.randint(0, 23), rng.randint(0, 59)),
+            "block": "0{:02d}XX W STREET {}".format(rng.randint(0, 99), rng.randint(1, 2000)),
+            "primary_type": rng.choice(primary_types),
+            "description": "SYNTHETIC",
+            "arrest": rng.random() < 0.2,
+            "domestic": rng.random() < 0.15,
+            "district": str(rng.randint(1, 25)),
+            "ward": str(rng.randint(1, 50)),
+            "community_area": str(rng.randint(1, 77)),
+        })
+        if rng.random() >= 0.01:
+            records[-1]["latitude"] = "{:.9f}".format(rng.uniform(41.645, 42.022))
+            records[-1]["longitude"] = "{:.9f}".format(rng.uniform(-87.934, -87.525))
+    return records
+
+
+class LocalRowIterator:
+    """Mimics the parts of google.cloud.bigquery.table.RowIterator used by the operators."""
+
+    def __init__(self, df, page_size=None):
+        self.df = df
+        self.page_size = page_size or max(len(df), 1)
+        self.schema = [SchemaField(name) for name in df.columns]
+
+    def to_dataframe(self):
+        return self.df.copy()
+
+    @property
+    def pages(self):
+        for start in range(0, len(self.df), self.page_size):
+            page = self.df.iloc[start:start + self.page_size]
+            yield [LocalRow(values) for values in page.itertuples(index=False, name=None)]
+
+
+class LocalRow:
+
+    def __init__(self, values):
+        self._values = values
+
+    def values(self):
+        return self._values
+
+
+class LocalQueryJob:
+
+    def __init__(self, df):
+        self.df = df
+
+    def result(self, page_size=None):
+        return LocalRowIterator(self.df, page_size)
+
+
+class LocalBigQueryClient:
+    """
+    Offline stand-in for google.cloud.bigquery.Client answering the GSOD queries issued by BigQueryToS3Operator
+    and the stations query of helpers.stations.
+
+    The yearly table, station, bounding box and month filters are read from the query text and applied to
+    synthetic (or given) yearly data, already joined to the stations table. A query of the stations table alone
+    is answered with gsod_stations, all of them reporting every day. Every query is recorded in `queries`,
+    so callers can count how many table scans a run paid for.
+
+    Attributes
+    ----------
+    tables : dict
+        optional mapping of year to a DataFrame in the GSOD layout; missing years are generated
+    queries : list
+        the query texts received so far
+    """
+
+    select_pattern = re.compile(r"SELECT\s+(?P<columns>.+?)\s+FROM", re.IGNORECASE | re.DOTALL)
+
+    bbox_pattern = re.compile(r"stations\.lat\s+BETWEEN\s+(\S+)\s+AND\s+(\S+)\s+AND\s+"
+                              r"stations\.lon\s+BETWEEN\s+(\S+)\s+AND\s+(\S+)", re.IGNORECASE)
+
+    def __init__(self, tables=None):
+        self.tables = tables or {}
+        self.queries = []
+
+    def query(self, sql):
+        self.queries.append(sql)
+        year = re.search(r"gsod(\d{4})", sql)
+        if year is None:
+            df = pd.DataFrame([{"stn": usaf, "station": "{}-{}".format(usaf, wban), "latitude": latitude,
+                                "longitude": longitude} for usaf, wban, latitude, longitude in gsod_stations])
+        else:
+            df = self.tables.get(int(year.group(1)))
+            if df is None:
+                df = synthetic_gsod_year(int(year.group(1)))
+        station = re.search(r"stn\s+like\s+'(\w+)'", sql, re.IGNORECASE)
+        if station:
+            df = df[df["stn"] == station.group(1)]
+        bbox = self.bbox_pattern.search(sql)
+        if bbox:
+            south, north, west, east = (float(bound) for bound in bbox.groups())
+            df = df[df["latitude"].between(south, north) & df["longitude"].between(west, east)]
+        month = re.search(r"mo\s+like\s+'(\d+)'", sql, re.IGNORECASE)
+        if month:
+            df = df[df["mo"] == month.group(1)]
+        # Select list items are read as their alias or their column name without the table alias.
+        columns = [re.split(r"\s+AS\s+", column.strip(), flags=re.IGNORECASE)[-1].split(".")[-1]
+                   for column in re.split(r",(?![^()]*\))", self.select_pattern.search(sql).group("columns"))]
+        if all(column in df.columns for column in columns):
+            df = df[columns]
+        return LocalQueryJob(df.reset_index(drop=True))
+
+
+class LocalTaskInstance:
+    """Keeps the XComs pushed and pulled by operators executed outside of Airflow."""
+
+    def __init__(self, task_id=None, xcoms=None):
+        self.task_id = task_id
+        self.xcoms = xcoms if xcoms is not None else {}
+
+    def xcom_push(self, key, value):
+        self.xcoms[(self.task_id, key)] = value
+
+    def xcom_pull(self, task_ids=None, key="return_value"):
+        return self.xcoms.get((task_ids, key))
+
+
+def local_context(data_interval_start, data_interval_end, task_id=None, xcoms=None):
+    """Returns the parts of the Airflow task context read by the operators."""
+    return {
+        "data_interval_start": data_interval_start,
+        "data_interval_end": data_interval_end,
+        "ti": LocalTaskInstance(task_id, xcoms),
+    }
+
+
+class LocalSocrataClient:
+    """Offline stand-in for sodapy.Socrata answering get() from a FakeSocrataServer without going through HTTP."""
+
+    def __init__(self, server):
+        self.server = server
+        self.queries = []
+
+    def get(self, dataset, query=None):
+        self.queries.append(query)
+        return self.server.answer(query)
+
+
+class FakeSocrataServer:
+    """
+    Local HTTP server answering the SoQL queries issued by SocrataToS3Operator against the crimes dataset.
+
+    It serves /resource/crimes.json from synthetic_crime_records and understands the month filter, keyset
+    (`:id > '...'`) and offset paging, `count(*)` and the select list. The first `failures` requests are
+    answered with 429 and 503 in turn, every response can be delayed by `latency` seconds, and the highest
+    number of requests served at the same time is recorded in `max_in_flight`.
+
+    Attributes
+    ----------
+    rows_per_month : int
+        number of crime records of every month
+    failures : int
+        number of requests answered with an error before the server behaves
+    latency : float
+        seconds every response is delayed by
+    url : str
+        base URL of the running server, to be passed as socrata_url
+    requests : list
+        the queries received so far
+
+    Methods
+    -------
+    start():
+        Starts the server on a free local port in a background thread.
+    stop():
+        Shuts the server down.
+    """
+
+    def __init__(self, rows_per_month=1000, failures=0, latency=0.0, seed=0):
+        self.rows_per_month = rows_per_month
+        self.failures = failures
+        self.latency = latency
+        self.seed = seed
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.months = {}
+        self.lock = threading.Lock()
+        self.httpd = None
+        self.url = None
+
+    def records(self, year, month):
+        if (year, month) not in self.months:
+            self.months[(year, month)] = synthetic_crime_records(year, month, self.rows_per_month, self.seed)
+        return self.months[(year, month)]
+
+    def answer(self, query):
+        """Returns the rows of a SoQL query against the synthetic crimes dataset."""
+        year = int(re.search(r"date_extract_y\(date\)\s*=\s*'(\d+)'", query).group(1))
+        month = int(re.search(r"date_extract_m\(date\)\s*=\s*'(\d+)'", query).group(1))
+        rows = self.records(year, month)
+        last_id = re.search(r":id\s*>\s*'([^']*)'", query)
+        if last_id:
+            rows = [row for row in rows if row[":id"] > last_id.group(1)]
+        if re.search(r"count\(\*\)", query, re.IGNORECASE):
+            return [{"row_count": str(len(rows))}]
+        offset = re.search(r"offset\s+(\d+)", query, re.IGNORECASE)
+        limit = re.search(r"limit\s+(\d+)", query, re.IGNORECASE)
+        start = int(offset.group(1)) if offset else 0
+        rows = rows[start:start + int(limit.group(1))] if limit else rows[start:]
+        columns = [column.strip() for column in
+                   re.search(r"select\s+(.+?)\s+where", query, re.IGNORECASE | re.DOTALL).group(1).split(",")]
+        return [{column: row[column] for column in columns if column in row} for row in rows]
+
+    def handle(self, path):
+        """Returns the status code and JSON body answering a request path."""
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            request_number = len(self.requests)
+            query = parse_qs(urlparse(path).query).get("$query", [""])[0]
+            self.requests.append(query)
+        try:
+            time.sleep(self.latency)
+            if request_number < self.failures:
+                return (429 if request_number % 2 == 0 else 503), {"message": "try again"}
+            return 200, self.answer(query)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                status, body = fake.handle(self.path)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:{}".format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class LocalRedshiftDataClient:
+    """
+    Offline stand-in for the boto3 `redshift-data` client, running the statements on a local database.
+
+    Statements run on a background thread, on a connection returned by `connect` (e.g. a psycopg2.connect
+    partial pointing at a local PostgreSQL), and several statements run as one transaction like
+    batch_execute_statement. describe_statement reports SUBMITTED, STARTED, FINISHED or FAILED with the duration in
+    nanoseconds, and get_statement_result returns the rows in the Data API field format, `page_size` at a time.
+
+    Attributes
+    ----------
+    connect : callable
+        returns a new DB-API connection
+    latency : float
+        seconds every statement is delayed by before it runs
+    page_size : int
+        rows per get_statement_result page
+    statements : dict
+        statement id to its description
+    """
+
+    def __init__(self, connect, latency=0.0, page_size=1000):
+        self.connect = connect
+        self.latency = latency
+        self.page_size = page_size
+        self.statements = {}
+        self.results = {}
+        self.query_ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def execute_statement(self, Sql, **options):
+        return {"Id": self.start_statements([Sql], batch=False)}
+
+    def batch_execute_statement(self, Sqls, **options):
+        return {"Id": self.start_statements(Sqls, batch=True)}
+
+    def start_statements(self, sqls, batch):
+        statement_id = str(uuid.uuid4())
+        description = {"Id": statement_id, "Status": "SUBMITTED", "Duration": -1, "QueryString": ";".join(sqls)}
+        if batch:
+            description["SubStatements"] = [{"Id": "{}:{}".format(statement_id, index + 1), "Status": "SUBMITTED",
+                                             "QueryString": sql} for index, sql in enumerate(sqls)]
+        with self.lock:
+            self.statements[statement_id] = description
+        threading.Thread(target=self.run_statements, args=(description, sqls), daemon=True).start()
+        return statement_id
+
+    def run_statements(self, description, sqls):
+        time.sleep(self.latency)
+        started = time.time()
+        targets = description.get("SubStatements", [description])
+        with self.lock:
+            description["Status"] = "STARTED"
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            for target, sql in zip(targets, sqls):
+                cursor.execute(sql)
+                has_result_set = cursor.description is not None
+                result_rows = cursor.rowcount
+                if has_result_set:
+                    self.results[target["Id"]] = [list(row) for row in cursor.fetchall()]
+                    result_rows = len(self.results[target["Id"]])
+                with self.lock:
+                    target.update({"Status": "FINISHED", "HasResultSet": has_result_set,
+                                   "ResultRows": result_rows, "RedshiftQueryId": next(self.query_ids)})
+            conn.commit()
+            status, error = "FINISHED", None
+        except Exception as statement_error:
+            conn.rollback()
+            status, error = "FAILED", str(statement_error)
+        finally:
+            conn.close()
+        with self.lock:
+            description.update({"Status": status, "Duration": int((time.time() - started) * 1e9)})
+            if error:
+                description["Error"] = error
+            if "SubStatements" in description:
+                description["ResultRows"] = sum(max(sub.get("ResultRows", 0), 0) for sub in targets)
+
+    def describe_statement(self, Id):
+        with self.lock:
+            return json.loads(json.dumps(self.statements[Id]))
+
+    @staticmethod
+    def field(value):
+        if value is None:
+            return {"isNull": True}
+        if isinstance(value, bool):
+            return {"booleanValue": value}
+        if isinstance(value, numbers.Integral):
+            return {"longValue": int(value)}
+        if isinstance(value, numbers.Number):
+            return {"doubleValue": float(value)}
+        return {"stringValue": str(value)}
+
+    def get_statement_result(self, Id, NextToken=None):
+        rows = self.results.get(Id, [])
+        start = int(NextToken or 0)
+        page = rows[start:start + self.page_size]
+        response = {"Records": [[LocalRedshiftDataClient.field(value) for value in row] for row in page],
+                    "TotalNumRows": len(rows)}
+        if start + self.page_size < len(rows):
+            response["NextToken"] = str(start + self.page_size)
+        return response
+
+
+async def first_event(trigger):
+    async for event in trigger.run():
+        return event
+
+
+def run_deferred(operator, context):
+    """
+    Runs an operator like Airflow would when it defers: the trigger runs in process against the operator's
+    Data API client and the operator resumes with the event. Returns what the operator finally returns.
+    """
+    from airflow.exceptions import TaskDeferred
+    try:
+        return operator.execute(context)
+    except TaskDeferred as deferred:
+        deferred.trigger.client = operator.get_data_api_client()
+        event = asyncio.run(first_event(deferred.trigger))
+        return getattr(operator, deferred.method_name)(context, event=event.payload, **(deferred.kwargs or {}))
@@ -0,0 +1,117 @@
+"""
+Assignment of every crime to its nearest GSOD weather station, so each crime is joined to the weather observed
+closest to it rather than to a single airport.
+"""
+import collections
+import threading
+
+# Station of the crimes without a location, or pulled without a bounding box; the fact queries join it to the
+# weather of all stations of the day (SqlQueries.station_weather).
+city_station = "city"
+
+# GSOD stations matching a bbox_filter, in the station id format of the weather extract.
+stations_query = """
+        SELECT CONCAT(stations.usaf, '-', stations.wban) AS station, stations.lat AS latitude, stations.lon AS longitude
+        FROM bigquery-public-data.noaa_gsod.stations AS stations
+        WHERE {stations}
+        ORDER BY station
+        """
+
+# Number of (bbox, first_day, last_day) station sets kept by gsod_stations
+station_cache_size = 64
+
+station_cache = collections.OrderedDict()
+
+station_cache_lock = threading.Lock()
+
+
+def interval_days(months):
+    """Returns the first and last day (YYYYMMDD) of the (year, zero padded month) list of months_in_interval."""
+    return "{}{}01".format(*months[0]), "{}{}31".format(*months[-1])
+
+
+def bbox_filter(bbox, first_day, last_day):
+    """
+    Returns the condition on the GSOD stations table (aliased `stations`) selecting the stations inside the
+    [south, west, north, east] bounding box that reported between the two days (YYYYMMDD, as in its begin and end
+    columns). Both pulls select their stations with it, so the crimes are only assigned to pulled stations.
+    """
+    south, west, north, east = bbox
+    return ("stations.lat BETWEEN {} AND {} AND stations.lon BETWEEN {} AND {} "
+            "AND stations.begin <= '{}' AND stations.`end` >= '{}'").format(south, north, west, east,
+                                                                            last_day, first_day)
+
+
+def unit_vectors(latitudes, longitudes):
+    """Returns the points on the unit sphere of the given coordinates in degrees, one row per point."""
+    import numpy as np
+    latitudes = np.radians(latitudes)
+    longitudes = np.radians(longitudes)
+    return np.column_stack([np.cos(latitudes) * np.cos(longitudes),
+                            np.cos(latitudes) * np.sin(longitudes),
+                            np.sin(latitudes)])
+
+
+def gsod_stations(client, bbox, first_day, last_day):
+    """
+    Returns (station, latitude, longitude) of the GSOD stations selected by bbox_filter, read with one small query
+    of the static stations table. The last `station_cache_size` station sets are cached for the worker process,
+    keyed by the bounding box and days only.
+    """
+    key = (tuple(bbox), first_day, last_day)
+    with station_cache_lock:
+        if key in station_cache:
+            station_cache.move_to_end(key)
+            return station_cache[key]
+    query = stations_query.format(stations=bbox_filter(bbox, first_day, last_day))
+    df = client.query(query).result().to_dataframe().dropna(subset=["latitude", "longitude"])
+    stations = tuple((station, float(latitude), float(longitude))
+                     for station, latitude, longitude in df[["station", "latitude", "longitude"]].itertuples(
+                         index=False))
+    with station_cache_lock:
+        station_cache[key] = stations
+        if len(station_cache) > station_cache_size:
+            station_cache.popitem(last=False)
+    return stations
+
+
+class StationIndex:
+    """
+    KD-tree of the weather stations of a run, assigning whole pages of crimes to their nearest station.
+
+    The stations are indexed as points on the unit sphere, where the nearest point by straight-line distance is
+    also the nearest by great-circle distance, so no projection has to fit the bounding box. The tree is built
+    once per run and every page is assigned with one vectorized query.
+
+    Attributes
+    ----------
+    stations : list
+        (station, latitude, longitude) of every indexed station
+
+    Methods
+    -------
+    assign(latitudes, longitudes):
+        Returns the nearest station of every point as an array, city_station where a coordinate is missing.
+    """
+
+    def __init__(self, stations):
+        import numpy as np
+        from scipy.spatial import cKDTree
+        self.stations = [tuple(station) for station in stations]
+        if not self.stations:
+            raise ValueError("A station index needs at least one station")
+        self.station_ids = np.array([station for station, _, _ in self.stations], dtype=object)
+        self.tree = cKDTree(unit_vectors([latitude for _, latitude, _ in self.stations],
+                                         [longitude for _, _, longitude in self.stations]))
+
+    def assign(self, latitudes, longitudes):
+        import numpy as np
+        import pandas as pd
+        latitudes = pd.to_numeric(pd.Series(latitudes), errors="coerce").to_numpy(dtype=float)
+        longitudes = pd.to_numeric(pd.Series(longitudes), errors="coerce").to_numpy(dtype=float)
+        located = np.isfinite(latitudes) & np.isfinite(longitudes)
+        stations = np.full(len(latitudes), city_station, dtype=object)
+        if located.any():
+            _, nearest = self.tree.query(unit_vectors(latitudes[located], longitudes[located]))
+            stations[located] = self.station_ids[nearest]
+        return stations
@@ -0,0 +1,265 @@
+"""
+Execution backends of the warehouse operators. The Redshift connection of an operator either points at a Redshift
+cluster (any Postgres connection) or, with the connection type `duckdb`, at an embedded DuckDB database file. The
+embedded backend translates the Redshift-only parts of the pipeline SQL and loads the staged files straight from
+S3, an S3-compatible store or a local directory, so the same DAG runs on a single machine without a cluster.
+
+duckdb is imported inside DuckDBHook.get_conn, so parsing a DAG loads none of it.
+"""
+import re
+import time
+
+embedded_conn_type = "duckdb"
+
+table_options_pattern = re.compile(
+    r"\bDISTSTYLE\s+\w+|\bDISTKEY\s*\([^)]*\)|\b(?:COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)|\bENCODE\s+\w+",
+    re.IGNORECASE)
+
+create_like_pattern = re.compile(r"\bCREATE\s+TABLE\s+([\w.\"]+)\s*\(\s*LIKE\s+([\w.\"]+)\s*\)", re.IGNORECASE)
+
+# Redshift does not enforce primary keys, DuckDB does; they are dropped so both accept the same rows
+primary_key_pattern = re.compile(r",\s*CONSTRAINT\s+\w+\s+PRIMARY\s+KEY\s*\([^)]*\)|\s+PRIMARY\s+KEY\b(?!\s*\()",
+                                 re.IGNORECASE)
+
+count_rows_pattern = re.compile(r"\bcount\s*\(\s*[\w\"]+\.\*\s*\)", re.IGNORECASE)
+
+public_schema_pattern = re.compile(r"\bpublic\.", re.IGNORECASE)
+
+trunc_pattern = re.compile(r"\bTRUNC\s*\(", re.IGNORECASE)
+
+row_count_keywords = ("INSERT", "DELETE", "UPDATE")
+
+
+def warehouse_hook(conn_id):
+    """Returns the hook of the connection: a DuckDBHook for a duckdb connection, a PostgresHook otherwise."""
+    from airflow.hooks.base import BaseHook
+    connection = BaseHook.get_connection(conn_id)
+    if connection.conn_type == embedded_conn_type:
+        return DuckDBHook(connection)
+    from airflow.hooks.postgres_hook import PostgresHook
+    return PostgresHook(postgres_conn_id=conn_id)
+
+
+def is_embedded(hook):
+    return getattr(hook, "backend", "redshift") == embedded_conn_type
+
+
+def translate_trunc(sql):
+    """Rewrites the single-argument TRUNC(timestamp) of Redshift into a cast to DATE; TRUNC(x, n) is kept."""
+    output = []
+    position = 0
+    while True:
+        match = trunc_pattern.search(sql, position)
+        if match is None:
+            break
+        depth, end, top_level_commas = 1, match.end(), 0
+        while depth and end < len(sql):
+            if sql[end] == "(":
+                depth += 1
+            elif sql[end] == ")":
+                depth -= 1
+            elif sql[end] == "," and depth == 1:
+                top_level_commas += 1
+            end += 1
+        if depth or top_level_commas:
+            output.append(sql[position:match.end()])
+            position = match.end()
+            continue
+        output.append(sql[position:match.start()])
+        output.append("CAST({} AS DATE)".format(translate_trunc(sql[match.end():end - 1]).strip()))
+        position = end
+    output.append(sql[position:])
+    return "".join(output)
+
+
+def to_duckdb(sql):
+    """
+    Translates the Redshift-only parts of the pipeline SQL for DuckDB: table distribution, sort and encoding
+    options and the informational primary keys are dropped, CREATE TABLE ... (LIKE ...) copies the columns with an empty CREATE TABLE AS,
+    TRUNC(timestamp) becomes a cast to DATE, count(table.*) becomes count(*) and the public schema is DuckDB's
+    main schema. `::int` casts and extract(dayofweek ...) run unchanged, DuckDB numbers the days from Sunday = 0
+    like Redshift.
+    """
+    sql = table_options_pattern.sub("", sql)
+    sql = primary_key_pattern.sub("", sql)
+    sql = create_like_pattern.sub(r"CREATE TABLE \1 AS SELECT * FROM \2 LIMIT 0", sql)
+    sql = count_rows_pattern.sub("count(*)", sql)
+    sql = public_schema_pattern.sub("main.", sql)
+    return translate_trunc(sql)
+
+
+class DuckDBCursor:
+    """
+    Cursor of a DuckDBConnection with the part of the DB-API the operators use. Every statement is translated
+    with to_duckdb and runs in the transaction of its connection; rowcount is the number of rows an INSERT,
+    DELETE or UPDATE touched and -1 otherwise, as with psycopg2.
+    """
+
+    backend = embedded_conn_type
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.result = None
+        self.rowcount = -1
+
+    def execute(self, statement):
+        self.connection.begin()
+        self.result = self.connection.connection.execute(to_duckdb(statement))
+        keyword = statement.split(None, 1)[0].upper() if statement.strip() else ""
+        self.rowcount = self.result.fetchone()[0] if keyword in row_count_keywords else -1
+
+    def fetchall(self):
+        return self.result.fetchall()
+
+    def fetchone(self):
+        return self.result.fetchone()
+
+    def close(self):
+        self.result = None
+
+
+class DuckDBConnection:
+    """
+    Wraps a DuckDB connection like a psycopg2 connection: unless autocommit is set, statements run in one
+    transaction until commit() or rollback(), and closing the connection discards an open transaction. All
+    cursors share the connection, and so its transaction and temp tables.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.autocommit = False
+        self.in_transaction = False
+
+    def cursor(self):
+        return DuckDBCursor(self)
+
+    def begin(self):
+        if not self.autocommit and not self.in_transaction:
+            self.connection.execute("BEGIN TRANSACTION")
+            self.in_transaction = True
+
+    def commit(self):
+        if self.in_transaction:
+            self.connection.execute("COMMIT")
+            self.in_transaction = False
+
+    def rollback(self):
+        if self.in_transaction:
+            self.connection.execute("ROLLBACK")
+            self.in_transaction = False
+
+    def close(self):
+        self.rollback()
+        self.connection.close()
+
+
+class DuckDBHook:
+    """
+    Embedded DuckDB backend standing in for PostgresHook in the warehouse operators.
+
+    The database file is read from the `database` extra of the connection (or its schema), e.g.
+    `duckdb://?database=%2Fopt%2Fairflow%2Fwarehouse.duckdb`. Staged objects are read from S3 through DuckDB's
+    httpfs extension, or from an S3-compatible store given the `s3_endpoint`, `s3_url_style` and `s3_use_ssl`
+    extras. With a `store_root` extra, s3://<bucket>/<key> is read from <store_root>/<bucket>/<key> instead.
+
+    Only one process can write to a DuckDB file at a time. A task finding the file locked by another task retries
+    for `lock_timeout` seconds (default 300); give the warehouse tasks a pool of one slot to avoid the wait.
+
+    Attributes
+    ----------
+    database : str
+        path of the database file
+    store_root : str
+        local directory standing in for S3, None to read from S3
+    s3_settings : dict
+        DuckDB s3_* settings of the connection
+    s3_credentials : object
+        AWS credentials (access_key, secret_key, token) used to read from S3, set by the staging operator
+    lock_timeout : float
+        seconds to wait for a database file locked by another process
+
+    Methods
+    -------
+    get_conn():
+        Opens a DuckDBConnection on the database file.
+    set_autocommit(conn, autocommit):
+        Like PostgresHook.set_autocommit.
+    get_records(sql):
+        Like PostgresHook.get_records.
+    run(sql, autocommit):
+        Runs one or several statements, e.g. dags/support/create_tables.sql, like PostgresHook.run.
+    source_path(url):
+        Returns the path DuckDB reads an s3:// url from.
+    """
+
+    backend = embedded_conn_type
+
+    def __init__(self, connection):
+        extras = connection.extra_dejson
+        self.database = extras.get("database") or connection.schema
+        if not self.database:
+            raise ValueError("The DuckDB connection {} names no database file".format(connection.conn_id))
+        self.store_root = extras.get("store_root")
+        self.s3_settings = {
+            "s3_region": extras.get("s3_region", "us-west-2"),
+            "s3_endpoint": extras.get("s3_endpoint"),
+            "s3_url_style": extras.get("s3_url_style"),
+            "s3_use_ssl": extras.get("s3_use_ssl"),
+        }
+        self.s3_credentials = None
+        self.lock_timeout = float(extras.get("lock_timeout", 300))
+
+    def get_conn(self):
+        import duckdb
+        deadline = time.time() + self.lock_timeout
+        while True:
+            try:
+                connection = duckdb.connect(self.database)
+                break
+            except duckdb.IOException as error:
+                if "lock" not in str(error).lower() or time.time() > deadline:
+                    raise
+                time.sleep(0.5)
+        if self.s3_credentials is not None and not self.store_root:
+            self.configure_s3(connection)
+        return DuckDBConnection(connection)
+
+    def configure_s3(self, connection):
+        connection.execute("INSTALL httpfs")
+        connection.execute("LOAD httpfs")
+        settings = dict(self.s3_settings,
+                        s3_access_key_id=self.s3_credentials.access_key,
+                        s3_secret_access_key=self.s3_credentials.secret_key,
+                        s3_session_token=self.s3_credentials.token)
+        for name, value in settings.items():
+            if value is not None:
+                connection.execute("SET {} = '{}'".format(name, str(value).replace("'", "''")))
+
+    def set_autocommit(self, conn, autocommit):
+        conn.autocommit = autocommit
+
+    def get_records(self, sql):
+        conn = self.get_conn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql)
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def run(self, sql, autocommit=False):
+        statements = [sql] if isinstance(sql, str) else sql
+        conn = self.get_conn()
+        try:
+            self.set_autocommit(conn, autocommit)
+            cursor = conn.cursor()
+            for statement in statements:
+                cursor.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def source_path(self, url):
+        if self.store_root and url.startswith("s3://"):
+            return "{}/{}".format(self.store_root.rstrip("/"), url[len("s3://"):])
+        return url
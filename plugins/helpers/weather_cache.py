@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+
+class GsodYearCache:
+    """
+    Local, content-addressed cache of yearly NOAA GSOD station extracts.
+
+    Entries are keyed by year, station and a hash of the query text and stored as parquet files named by the
+    digest of that key. Past years never change, so they never expire; the current year is re-queried once
+    its entry is older than current_year_ttl. When the cache grows beyond max_bytes the least recently used
+    entries are evicted.
+
+    Attributes
+    ----------
+    cache_dir : str
+        directory holding the cached extracts
+    max_bytes : int
+        size budget of the cache directory
+    current_year_ttl : int
+        number of seconds a current-year entry is considered fresh
+
+    Methods
+    -------
+    get(year, station, query):
+        Returns the cached extract or None when it is missing or stale.
+    put(year, station, query, df):
+        Stores an extract and evicts old entries over the size budget.
+    get_or_fetch(year, station, query, fetch):
+        Returns the cached extract, calling fetch() and caching the result on a miss.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 1024 * 1024, current_year_ttl=24 * 60 * 60):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.current_year_ttl = current_year_ttl
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def digest(year, station, query):
+        query_hash = hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()
+        key = "{}|{}|{}".format(year, station, query_hash)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _paths(self, digest):
+        base = os.path.join(self.cache_dir, digest)
+        return base + ".parquet", base + ".json"
+
+    def is_fresh(self, metadata, now=None):
+        now = now or time.time()
+        if int(metadata["year"]) < datetime.utcfromtimestamp(now).year:
+            return True
+        return now - metadata["fetched_at"] < self.current_year_ttl
+
+    def get(self, year, station, query):
+        data_path, meta_path = self._paths(GsodYearCache.digest(year, station, query))
+        if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+            return None
+        with open(meta_path) as meta_file:
+            metadata = json.load(meta_file)
+        if not self.is_fresh(metadata):
+            return None
+        os.utime(data_path)
+        return pd.read_parquet(data_path)
+
+    def put(self, year, station, query, df):
+        digest = GsodYearCache.digest(year, station, query)
+        data_path, meta_path = self._paths(digest)
+        self._write_atomically(data_path, "wb", lambda data_file: df.to_parquet(data_file, index=False))
+        metadata = {
+            "year": int(year),
+            "station": station,
+            "query_hash": hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest(),
+            "fetched_at": time.time(),
+            "rows": len(df),
+        }
+        self._write_atomically(meta_path, "w", lambda meta_file: json.dump(metadata, meta_file))
+        self.evict(keep=digest)
+
+    def _write_atomically(self, path, mode, write):
+        """
+        Writes a file through a uniquely named temporary file in the cache directory, so concurrent writers of the
+        same entry never interleave and readers only ever see a complete file.
+        """
+        with tempfile.NamedTemporaryFile(mode, dir=self.cache_dir, prefix=os.path.basename(path) + ".",
+                                         suffix=".tmp", delete=False) as temp_file:
+            temp_path = temp_file.name
+            try:
+                write(temp_file)
+            except BaseException:
+                temp_file.close()
+                os.remove(temp_path)
+                raise
+        os.replace(temp_path, path)
+
+    def get_or_fetch(self, year, station, query, fetch):
+        df = self.get(year, station, query)
+        if df is not None:
+            return df
+        df = fetch()
+        self.put(year, station, query, df)
+        return df
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits into max_bytes."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".parquet"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name[:-len(".parquet")], stat.st_size))
+            total += stat.st_size
+        for _, digest, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            for path in self._paths(digest):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
@@ -0,0 +1,40 @@
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from helpers.scoped_staging import scoped_table_name
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
+
+class DropStagingTablesOperator(BaseOperator):
+    """
+    Drops the staging tables of the run's data interval once the fact and dimension tables have been loaded.
+
+    Attributes
+    ----------
+    redshift_conn_id : str
+        redshift connection id
+    tables : list
+        permanent staging tables whose scoped copies are dropped
+
+    Methods
+    -------
+    execute():
+        Executes the drop of the scoped staging tables in Redshift
+    """
+    ui_color = '#C0C0C0'
+
+    @apply_defaults
+    def __init__(self,
+                 redshift_conn_id="",
+                 tables=None,
+                 *args, **kwargs):
+
+        super(DropStagingTablesOperator, self).__init__(*args, **kwargs)
+        self.redshift_conn_id = redshift_conn_id
+        self.tables = tables or []
+
+    @instrumented
+    def execute(self, context):
+        redshift = warehouse_hook(self.redshift_conn_id)
+        scoped_tables = [scoped_table_name(table, context) for table in self.tables]
+        self.metrics.run(redshift, ['DROP TABLE IF EXISTS %s' % table for table in scoped_tables])
+        self.log.info('Dropped staging tables {}'.format(", ".join(scoped_tables)))
@@ -1,59 +1,151 @@
-from airflow.hooks.postgres_hook import PostgresHook
+import operator
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
 
 class DataQualityOperator(BaseOperator):
     """
         Testing the quality of the final tables.
 
+        Every check is a dict with a scalar check_sql, an expected_result and an optional comparison
+        (one of ==, !=, <, <=, >, >= or between, which takes [low, high] as expected_result; defaults to ==).
+        The check_sql of a check with `interval` set is formatted with the {start} and {end} dates of the run's
+        data interval.
+
         Attributes
         ----------
         redshift_conn_id : str
             redshift connection id
         dq_check : list
             list of tables to test
+        mode : str
+            "batch" runs all checks as scalar subqueries of a single query (one round trip),
+            "concurrent" runs them in parallel on up to max_workers connections,
+            "sequential" runs them one by one
+        max_workers : int
+            size of the connection pool in concurrent mode
 
         Methods
         -------
         execute():
-            Executes the data quality check in Redshift
+            Executes the data quality check in Redshift and pushes the value and latency of every check
+            to XCom under the key dq_results
+        evaluate(context, values, latencies):
+            Compares the values of the checks with their expected results and raises if any check failed
+        render_checks(context):
+            Formats the checks flagged `interval` with the run's data interval
         """
     ui_color = '#F5DEB3'
 
+    comparisons = {
+        "==": operator.eq,
+        "!=": operator.ne,
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+        "between": lambda value, expected: expected[0] <= value <= expected[1],
+    }
+
+    modes = ("batch", "concurrent", "sequential")
 
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  dq_checks=[],
+                 mode="batch",
+                 max_workers=4,
                  *args, **kwargs):
 
         super(DataQualityOperator, self).__init__(*args, **kwargs)
+        if mode not in DataQualityOperator.modes:
+            raise ValueError("Unknown data quality mode: {}".format(mode))
+        for check in dq_checks:
+            if check.get("comparison", "==") not in DataQualityOperator.comparisons:
+                raise ValueError("Unknown comparison in data quality check: {}".format(check))
 
         self.redshift_conn_id = redshift_conn_id
         self.dq_checks = dq_checks
+        self.mode = mode
+        self.max_workers = max_workers
 
+    @instrumented
     def execute(self, context):
 
-        redshift = PostgresHook(self.redshift_conn_id)
-        error_count = 0
+        self.render_checks(context)
+        redshift = warehouse_hook(self.redshift_conn_id)
+        if self.mode == "batch":
+            values, latencies = self.run_batched(redshift)
+        elif self.mode == "concurrent":
+            values, latencies = self.run_concurrently()
+        else:
+            outcomes = [self.run_check(redshift, check["check_sql"]) for check in self.dq_checks]
+            values, latencies = [value for value, _ in outcomes], [latency for _, latency in outcomes]
+
+        self.evaluate(context, values, latencies)
+
+    def render_checks(self, context):
+        start = context["data_interval_start"].strftime('%Y-%m-%d')
+        end = context["data_interval_end"].strftime('%Y-%m-%d')
+        self.dq_checks = [dict(check, check_sql=check["check_sql"].format(start=start, end=end), interval=False)
+                          if check.get("interval") else check for check in self.dq_checks]
+
+    def evaluate(self, context, values, latencies):
+        """Compares the check values with their expected results, pushes dq_results and fails on any mismatch."""
+        results = []
         failing_tests = []
-        boolean_tables = ["crime_arrest", "crime_domestic"]
-        for checks in self.dq_checks:
-            sql = checks["check_sql"]
-            records_query = redshift.get_records(sql)[0][0]
-            self.log.info("Number of records found:{}".format(records_query))
-            if any(x in sql for x in boolean_tables):
-                if records_query == 0 or records_query > checks["expected_result"]:
-                    error_count += 1
-                    failing_tests.append(sql)
-            else:
-                if records_query != checks["expected_result"]:
-                    error_count += 1
-                    failing_tests.append(sql)
-        if error_count > 0:
+        for check, value, latency in zip(self.dq_checks, values, latencies):
+            comparison = check.get("comparison", "==")
+            passed = value is not None and DataQualityOperator.comparisons[comparison](value, check["expected_result"])
+            self.log.info("{} returned {} (expected {} {}) in {:.3f}s".format(
+                check["check_sql"], value, comparison, check["expected_result"], latency))
+            results.append({
+                "check_sql": check["check_sql"],
+                "comparison": comparison,
+                "expected_result": check["expected_result"],
+                "value": value,
+                "passed": passed,
+                "latency_s": round(latency, 3),
+            })
+            if not passed:
+                failing_tests.append(check["check_sql"])
+        context["ti"].xcom_push(key="dq_results", value=results)
+
+        if len(failing_tests) > 0:
             self.log.info("Error, query does not match expected results")
             self.log.info(failing_tests)
             raise ValueError("Data quality check has failed")
 
         else:
-            self.log.info("Data quality check has passed on all tables")
\ No newline at end of file
+            self.log.info("Data quality check has passed on all tables")
+
+    def run_check(self, redshift, sql):
+        start = time.time()
+        value = self.metrics.get_records(redshift, sql, phase="checks")[0][0]
+        return value, time.time() - start
+
+    def run_batched(self, redshift):
+        """Runs every check as a scalar subquery of one SELECT; each check reports the latency of that query."""
+        if not self.dq_checks:
+            return [], []
+        start = time.time()
+        values = list(self.metrics.get_records(redshift, self.batched_sql(), phase="checks")[0])
+        latency = time.time() - start
+        return values, [latency] * len(values)
+
+    def batched_sql(self):
+        return "SELECT {}".format(", ".join(
+            "({}) AS check_{}".format(check["check_sql"].strip().rstrip(";"), index)
+            for index, check in enumerate(self.dq_checks)))
+
+    def run_concurrently(self):
+        def run(check):
+            return self.run_check(warehouse_hook(self.redshift_conn_id), check["check_sql"])
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            outcomes = list(executor.map(run, self.dq_checks))
+        return [value for value, _ in outcomes], [latency for _, latency in outcomes]
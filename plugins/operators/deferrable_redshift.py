@@ -0,0 +1,150 @@
+from airflow.utils.decorators import apply_defaults
+from operators.s3_to_staging_redshift import StageToRedshiftOperator
+from operators.load_fact import LoadFactOperator
+from operators.load_dimension import LoadDimensionOperator
+from operators.data_quality import DataQualityOperator
+from helpers.redshift_data import (data_api_client, connection_target, submit_statements, fetch_records,
+                                   finished_statuses)
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
+from triggers.redshift_data import RedshiftStatementTrigger
+
+
+class RedshiftDataApiMixin:
+    """
+    Runs the statements of a Redshift operator through the Redshift Data API and defers the task until they
+    finished, so no worker slot is held while Redshift works. Several statements are submitted as one
+    transaction. When the task resumes, the statement id, status, duration and Redshift query ids are pushed
+    to XCom under `redshift_statement` and added to the task's metrics.
+
+    Attributes
+    ----------
+    data_api_conn_id : str
+        AWS credentials allowed to call the Data API
+    cluster_identifier : str
+        Redshift cluster, read from the host of the Redshift connection when empty
+    database : str
+        database, read from the schema of the Redshift connection when empty
+    db_user : str
+        database user, read from the login of the Redshift connection when empty
+    region_name : str
+        region of the cluster
+    poll_interval : float
+        seconds between two polls of the statement by the trigger
+
+    Methods
+    -------
+    submit(statements, phase):
+        Submits the statements and defers the task to RedshiftStatementTrigger.
+    execute_complete(context, event, phase):
+        Resumes the task with the outcome of the statements, raises ValueError if they failed.
+    complete(context, outcome):
+        Hook run once the statements finished; the returned value is the task's return value.
+    get_data_api_client():
+        Returns the Data API client, override it to use a local stand-in.
+    """
+
+    def __init__(self,
+                 data_api_conn_id="",
+                 cluster_identifier=None,
+                 database=None,
+                 db_user=None,
+                 region_name="us-west-2",
+                 poll_interval=10,
+                 *args, **kwargs):
+        super(RedshiftDataApiMixin, self).__init__(*args, **kwargs)
+        self.data_api_conn_id = data_api_conn_id
+        self.cluster_identifier = cluster_identifier
+        self.database = database
+        self.db_user = db_user
+        self.region_name = region_name
+        self.poll_interval = poll_interval
+
+    def get_data_api_client(self):
+        return data_api_client(self.data_api_conn_id, self.region_name)
+
+    def submit(self, statements, phase="sql"):
+        target = connection_target(self.redshift_conn_id, self.cluster_identifier, self.database, self.db_user)
+        with self.metrics.phase("submit"):
+            statement_id = submit_statements(self.get_data_api_client(), target, statements,
+                                             statement_name=self.task_id)
+        self.log.info("Submitted {} statement(s) to cluster {} as {}".format(
+            len(statements), target["ClusterIdentifier"], statement_id))
+        self.defer(trigger=RedshiftStatementTrigger(statement_id, self.data_api_conn_id, self.region_name,
+                                                    self.poll_interval),
+                   method_name="execute_complete",
+                   kwargs={"phase": phase})
+
+    @instrumented
+    def execute_complete(self, context, event=None, phase="sql"):
+        if event["status"] not in finished_statuses:
+            raise ValueError("Redshift statement {} {}: {}".format(
+                event["statement_id"], event["status"].lower(), event["error"]))
+        self.metrics.record_statement(event, phase)
+        self.log.info("Statement {} finished in {}s, Redshift query ids {}".format(
+            event["statement_id"], event["duration_s"], event["redshift_query_ids"]))
+        context["ti"].xcom_push(key="redshift_statement", value=event)
+        return self.complete(context, event)
+
+    def complete(self, context, outcome):
+        return None
+
+
+class DeferrableStageToRedshiftOperator(RedshiftDataApiMixin, StageToRedshiftOperator):
+    """StageToRedshiftOperator deferring while the COPY runs through the Redshift Data API."""
+
+    def copy(self, redshift, target_table, s3_path, credentials, manifest=False):
+        self.submit([self.copy_statement(target_table, s3_path, credentials, manifest)], phase="copy")
+
+
+class DeferrableLoadFactOperator(RedshiftDataApiMixin, LoadFactOperator):
+    """LoadFactOperator deferring while the load runs through the Redshift Data API."""
+
+    @instrumented
+    def execute(self, context):
+        self.submit(self.load_statements(context))
+
+
+class DeferrableLoadDimensionOperator(RedshiftDataApiMixin, LoadDimensionOperator):
+    """
+    LoadDimensionOperator deferring while the load runs through the Redshift Data API. The table keys of upsert
+    mode are still looked up over the Redshift connection before the task defers.
+    """
+
+    @instrumented
+    def execute(self, context):
+        self.submit(self.load_statements(context, warehouse_hook(self.redshift_conn_id)))
+
+    def load_statements(self, context, redshift):
+        statements = super(DeferrableLoadDimensionOperator, self).load_statements(context, redshift)
+        if self.mode != "truncate":
+            return statements
+        # TRUNCATE would commit the submitted transaction in Redshift, so the truncate mode deletes instead and
+        # the dimension is never visible empty.
+        return ['DELETE FROM %s' % self.target_table] + statements[1:]
+
+
+class DeferrableDataQualityOperator(RedshiftDataApiMixin, DataQualityOperator):
+    """
+    DataQualityOperator deferring while the batched checks run through the Redshift Data API. Only the batch
+    mode is supported; every check reports the duration of the batched query as its latency.
+    """
+
+    @apply_defaults
+    def __init__(self, *args, **kwargs):
+        super(DeferrableDataQualityOperator, self).__init__(*args, **kwargs)
+        if self.mode != "batch":
+            raise ValueError("Deferrable data quality checks only run in batch mode")
+
+    @instrumented
+    def execute(self, context):
+        self.render_checks(context)
+        if not self.dq_checks:
+            return self.evaluate(context, [], [])
+        self.submit([self.batched_sql()], phase="checks")
+
+    def complete(self, context, outcome):
+        # The task resumes on a new operator instance
+        self.render_checks(context)
+        values = list(fetch_records(self.get_data_api_client(), outcome["result_statement_id"])[0])
+        self.evaluate(context, values, [outcome["duration_s"]] * len(values))
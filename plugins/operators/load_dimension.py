@@ -1,6 +1,8 @@
-from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers.scoped_staging import scope_sql
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
 
 class LoadDimensionOperator(BaseOperator):
     """
@@ -14,32 +16,135 @@ class LoadDimensionOperator(BaseOperator):
         the target dimension table
     sql : str
         SQL statement that inserts the data to the dimension tables.
+    mode : str
+        "truncate" empties the table and reloads it,
+        "upsert" inserts only the rows whose key is not in the table yet,
+        "swap" rebuilds the table into a shadow copy and swaps it in, all in one transaction
+    primary_key : list
+        key columns used in upsert mode, looked up from the table's declared primary key when empty;
+        tables without a primary key are keyed on all of their columns
+    scoped_staging : bool
+        read the staging tables of the run's data interval instead of the permanent staging tables
 
     Methods
     -------
     execute():
         Executes the data transfer from staging tables to the dimension tables in Redshift
+    load_statements(context, redshift):
+        Returns the statements loading the dimension, looking up its keys in upsert mode
     """
     ui_color = '#80BD9E'
 
+    modes = ("truncate", "upsert", "swap")
+
+    primary_key_sql = """
+        SELECT kcu.column_name
+        FROM information_schema.table_constraints tc
+        JOIN information_schema.key_column_usage kcu
+          ON tc.constraint_name = kcu.constraint_name
+         AND tc.table_schema = kcu.table_schema
+         AND tc.table_name = kcu.table_name
+        WHERE tc.constraint_type = 'PRIMARY KEY'
+          AND tc.table_name = '{}'
+        ORDER BY kcu.ordinal_position
+    """
+
+    columns_sql = """
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_name = '{}'
+        ORDER BY ordinal_position
+    """
+
+    upsert_sql = """
+        INSERT INTO {table} ({columns})
+        SELECT {source_columns}
+        FROM (
+            SELECT src.*, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {keys}) AS dedupe_rank
+            FROM ({sql}) AS src
+        ) AS src
+        WHERE src.dedupe_rank = 1
+          AND NOT EXISTS (
+            SELECT 1 FROM {table} AS dim
+            WHERE {conditions}
+        )
+    """
+
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  target_table="",
                  sql="",
+                 mode="truncate",
+                 primary_key=None,
+                 scoped_staging=False,
                  *args, **kwargs):
 
         super(LoadDimensionOperator, self).__init__(*args, **kwargs)
+        if mode not in LoadDimensionOperator.modes:
+            raise ValueError("Unknown dimension load mode: {}".format(mode))
         self.redshift_conn_id = redshift_conn_id
         self.target_table = target_table
         self.sql = sql
+        self.mode = mode
+        self.primary_key = primary_key or []
+        self.scoped_staging = scoped_staging
 
+    @instrumented
     def execute(self, context):
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
+        redshift = warehouse_hook(self.redshift_conn_id)
+        self.metrics.run(redshift, self.load_statements(context, redshift), autocommit=False)
+        self.log.info('Loading data into dimension table {}'.format(self.target_table))
+
+    def load_statements(self, context, redshift):
+        """Returns the statements loading the dimension in the operator's mode, run in one transaction."""
+        sql = scope_sql(self.sql, context) if self.scoped_staging else self.sql
+        if self.mode == "upsert":
+            with self.metrics.phase("metadata"):
+                columns, keys = LoadDimensionOperator.table_keys(redshift, self.target_table, self.primary_key)
+            return [LoadDimensionOperator.build_upsert_sql(self.target_table, sql, columns, keys)]
+        if self.mode == "swap":
+            return LoadDimensionOperator.build_swap_sql(self.target_table, sql)
+        # TRUNCATE commits on Redshift, so the table is briefly empty in this mode
+        return ['TRUNCATE TABLE %s' % (self.target_table), 'INSERT INTO %s %s' % (self.target_table, sql)]
 
-        redshift.run('TRUNCATE TABLE %s' % (self.target_table))
+    @staticmethod
+    def table_keys(redshift, table, primary_key=None):
+        """Returns the columns of the table and the key columns used to detect rows that already exist."""
+        table_name = table.strip('"').split(".")[-1]
+        columns = [row[0] for row in redshift.get_records(LoadDimensionOperator.columns_sql.format(table_name))]
+        keys = list(primary_key or [])
+        if not keys:
+            keys = [row[0] for row in redshift.get_records(LoadDimensionOperator.primary_key_sql.format(table_name))]
+        return columns, keys or columns
 
-        sql_statement = 'INSERT INTO %s %s' % (self.target_table, self.sql)
-        redshift.run(sql_statement)
+    @staticmethod
+    def build_upsert_sql(table, sql, columns, keys):
+        conditions = " AND ".join(
+            '(dim."{0}" = src."{0}" OR (dim."{0}" IS NULL AND src."{0}" IS NULL))'.format(key) for key in keys)
+        return LoadDimensionOperator.upsert_sql.format(
+            table=table,
+            columns=", ".join('"{}"'.format(column) for column in columns),
+            source_columns=", ".join('src."{}"'.format(column) for column in columns),
+            keys=", ".join('"{}"'.format(key) for key in keys),
+            sql=sql,
+            conditions=conditions)
 
-        self.log.info('Loading data into dimension table {}'.format(self.target_table))
\ No newline at end of file
+    @staticmethod
+    def build_swap_sql(table, sql):
+        """
+        Statements rebuilding the table into a shadow copy and renaming it into place. Readers keep seeing the
+        old rows until the transaction commits. The shadow copy keeps the distribution and sort keys of the
+        table but not its informational primary key, so upserts on swapped tables should pass primary_key.
+        """
+        table_name = table.strip('"').split(".")[-1]
+        swap_table = "{}_swap".format(table_name)
+        old_table = "{}_old".format(table_name)
+        return [
+            'DROP TABLE IF EXISTS {}'.format(swap_table),
+            'CREATE TABLE {} (LIKE {})'.format(swap_table, table),
+            'INSERT INTO {} {}'.format(swap_table, sql),
+            'ALTER TABLE {} RENAME TO {}'.format(table, old_table),
+            'ALTER TABLE {} RENAME TO "{}"'.format(swap_table, table_name),
+            'DROP TABLE {}'.format(old_table),
+        ]
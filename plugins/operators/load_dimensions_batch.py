@@ -0,0 +1,103 @@
+import time
+
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from operators.load_dimension import LoadDimensionOperator
+from helpers.scoped_staging import scope_sql
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
+
+
+class BatchLoadDimensionOperator(BaseOperator):
+    """
+    Loads several dimension tables in Redshift from the staging tables on one connection and in one transaction.
+
+    The columns of the staging tables the dimension queries need are copied once into session temp tables that
+    carry the staging table names, so every dimension query reads the small projection instead of scanning the
+    staging tables again.
+
+    Attributes
+    ----------
+    redshift_conn_id : str
+        redshift connection id
+    dimensions : list
+        dimension specs, dicts with target_table, sql and optionally primary_key and mode (see LoadDimensionOperator)
+    staging_projections : dict
+        staging table name to the list of columns copied into its temp projection; empty to read staging directly
+    scoped_staging : bool
+        read the staging tables of the run's data interval instead of the permanent staging tables
+
+    Methods
+    -------
+    execute():
+        Executes the data transfer from the staging tables to all dimension tables and returns the seconds
+        spent on each dimension.
+    """
+    ui_color = '#80BD9E'
+
+    projection_sql = """
+        CREATE TEMP TABLE {table} AS
+        SELECT {columns}
+        FROM public.{table}
+    """
+
+    @apply_defaults
+    def __init__(self,
+                 redshift_conn_id="",
+                 dimensions=None,
+                 staging_projections=None,
+                 scoped_staging=False,
+                 *args, **kwargs):
+
+        super(BatchLoadDimensionOperator, self).__init__(*args, **kwargs)
+        self.redshift_conn_id = redshift_conn_id
+        self.dimensions = dimensions or []
+        self.staging_projections = staging_projections or {}
+        self.scoped_staging = scoped_staging
+
+    @instrumented
+    def execute(self, context):
+        redshift = warehouse_hook(self.redshift_conn_id)
+        with self.metrics.phase("metadata"):
+            plans = [(spec["target_table"], self.dimension_statements(redshift, spec)) for spec in self.dimensions]
+        projections = [BatchLoadDimensionOperator.projection_sql.format(table=table, columns=", ".join(columns))
+                       for table, columns in self.staging_projections.items()]
+        if self.scoped_staging:
+            plans = [(table, [scope_sql(statement, context) for statement in statements]) for table, statements in plans]
+            projections = [scope_sql(statement, context) for statement in projections]
+
+        timings = {}
+        conn = redshift.get_conn()
+        try:
+            cursor = conn.cursor()
+            start = time.time()
+            for statement in projections:
+                self.metrics.execute(cursor, statement, "projection")
+            timings["staging_projection"] = round(time.time() - start, 3)
+            self.log.info("Projected staging tables in {}s".format(timings["staging_projection"]))
+
+            for table, statements in plans:
+                start = time.time()
+                for statement in statements:
+                    self.metrics.execute(cursor, statement)
+                timings[table] = round(time.time() - start, 3)
+                self.log.info('Loaded dimension table {} in {}s'.format(table, timings[table]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return timings
+
+    @staticmethod
+    def dimension_statements(redshift, spec):
+        table = spec["target_table"]
+        mode = spec.get("mode", "upsert")
+        if mode == "upsert":
+            columns, keys = LoadDimensionOperator.table_keys(redshift, table, spec.get("primary_key"))
+            return [LoadDimensionOperator.build_upsert_sql(table, spec["sql"], columns, keys)]
+        if mode == "swap":
+            return LoadDimensionOperator.build_swap_sql(table, spec["sql"])
+        # TRUNCATE would commit the batch transaction in Redshift, so the truncate mode deletes instead.
+        return ['DELETE FROM %s' % table, 'INSERT INTO %s %s' % (table, spec["sql"])]
@@ -1,6 +1,8 @@
-from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
+from helpers.scoped_staging import scope_sql
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
 
 class LoadFactOperator(BaseOperator):
     """
@@ -14,28 +16,65 @@ class LoadFactOperator(BaseOperator):
             the target dimension table
         sql : str
             SQL statement that inserts the data to the dimension tables.
+        incremental : bool
+            only rebuild the rows of the run's data interval; the sql is formatted with {start} and {end}
+            and the existing rows of the interval are deleted and re-inserted in one transaction
+        date_column : str
+            date column of the target table that the data interval is matched on in incremental mode
+        scoped_staging : bool
+            read the staging tables of the run's data interval instead of the permanent staging tables
 
         Methods
         -------
         execute():
             Executes the data transfer from staging tables to the dimension tables in Redshift
+        load_statements(context):
+            Returns the statements loading the fact table for the run
         """
     ui_color = '#388E8E'
 
+    delete_interval_sql = """
+        DELETE FROM {table}
+        WHERE {column} >= '{start}' AND {column} < '{end}'
+    """
 
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
                  target_table="",
                  sql="",
+                 incremental=False,
+                 date_column="crime_date",
+                 scoped_staging=False,
                  *args, **kwargs):
         super(LoadFactOperator, self).__init__(*args, **kwargs)
         self.redshift_conn_id = redshift_conn_id
         self.target_table = target_table
         self.sql = sql
+        self.incremental = incremental
+        self.date_column = date_column
+        self.scoped_staging = scoped_staging
 
+    @instrumented
     def execute(self, context):
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
-        sql_statement = 'INSERT INTO %s %s' % (self.target_table, self.sql)
-        redshift.run(sql_statement)
+        redshift = warehouse_hook(self.redshift_conn_id)
+        # In incremental mode the delete and the insert run on one connection and are committed together,
+        # so a retry never duplicates days.
+        self.metrics.run(redshift, self.load_statements(context), autocommit=False)
         self.log.info('Loading data into fact table {}'.format(self.target_table))
+
+    def load_statements(self, context):
+        """Returns the statements loading the fact table, run in one transaction."""
+        sql = scope_sql(self.sql, context) if self.scoped_staging else self.sql
+        if not self.incremental:
+            return ['INSERT INTO %s %s' % (self.target_table, sql)]
+        start = context["data_interval_start"].strftime('%Y-%m-%d')
+        end = context["data_interval_end"].strftime('%Y-%m-%d')
+        self.log.info('Replacing rows of {} between {} and {}'.format(self.target_table, start, end))
+        delete_statement = LoadFactOperator.delete_interval_sql.format(
+            table=self.target_table,
+            column=self.date_column,
+            start=start,
+            end=end)
+        insert_statement = 'INSERT INTO %s %s' % (self.target_table, sql.format(start=start, end=end))
+        return [delete_statement, insert_statement]
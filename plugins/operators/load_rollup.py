@@ -0,0 +1,97 @@
+from datetime import timedelta
+
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+from helpers.scoped_staging import scope_sql
+from helpers.instrumentation import instrumented
+from helpers.warehouse import warehouse_hook
+
+
+class LoadRollupOperator(BaseOperator):
+    """
+    Maintains the pre-aggregated rollup tables of the fact table incrementally.
+
+    Only the partitions (weeks, months or days) that the run's data interval touches are rebuilt: their rows are
+    deleted and re-aggregated over whole partitions, so a week that straddles two months is recomputed from the
+    fact rows of both. All rollups are replaced in one transaction. With depends_on_past the runs rebuild shared
+    partitions in order, after the fact rows of both runs are loaded.
+
+    Attributes
+    ----------
+    redshift_conn_id : str
+        redshift connection id
+    rollups : list
+        rollup specs, dicts with target_table, period_column, grain (day, week or month) and sql, a SELECT
+        formatted with the {start} and {end} dates of the partitions to rebuild
+    scoped_staging : bool
+        read the staging tables of the run's data interval instead of the permanent staging tables
+
+    Methods
+    -------
+    execute():
+        Rebuilds the partitions of the data interval in every rollup table and returns them per table.
+    partition_bounds(grain, start, end):
+        Returns the first and the exclusive last date of the partitions covering [start, end).
+    """
+    ui_color = '#5F9EA0'
+
+    grains = ("day", "week", "month")
+
+    delete_partitions_sql = """
+        DELETE FROM {table}
+        WHERE {column} >= '{start}' AND {column} < '{end}'
+    """
+
+    @apply_defaults
+    def __init__(self,
+                 redshift_conn_id="",
+                 rollups=None,
+                 scoped_staging=False,
+                 *args, **kwargs):
+
+        super(LoadRollupOperator, self).__init__(*args, **kwargs)
+        for spec in rollups or []:
+            if spec.get("grain") not in LoadRollupOperator.grains:
+                raise ValueError("Unknown rollup grain: {}".format(spec))
+        self.redshift_conn_id = redshift_conn_id
+        self.rollups = rollups or []
+        self.scoped_staging = scoped_staging
+
+    @staticmethod
+    def partition_bounds(grain, start, end):
+        if grain == "day":
+            return start, end
+        if grain == "week":
+            # Weeks start on Monday, like DATE_TRUNC('week', ...) in Redshift
+            first = start - timedelta(days=start.weekday())
+            last = end - timedelta(days=end.weekday())
+            return first, last if last == end else last + timedelta(days=7)
+        first = start.replace(day=1)
+        if end.day == 1:
+            return first, end
+        return first, (end.replace(day=1) + timedelta(days=31)).replace(day=1)
+
+    @instrumented
+    def execute(self, context):
+        redshift = warehouse_hook(self.redshift_conn_id)
+        start = context["data_interval_start"].date()
+        end = context["data_interval_end"].date()
+
+        statements = []
+        partitions = {}
+        for spec in self.rollups:
+            first, last = LoadRollupOperator.partition_bounds(spec["grain"], start, end)
+            first, last = first.strftime('%Y-%m-%d'), last.strftime('%Y-%m-%d')
+            partitions[spec["target_table"]] = [first, last]
+            self.log.info("Rebuilding {} between {} and {}".format(spec["target_table"], first, last))
+            sql = scope_sql(spec["sql"], context) if self.scoped_staging else spec["sql"]
+            statements.append(LoadRollupOperator.delete_partitions_sql.format(
+                table=spec["target_table"],
+                column=spec["period_column"],
+                start=first,
+                end=last))
+            statements.append('INSERT INTO %s %s' % (spec["target_table"], sql.format(start=first, end=last)))
+
+        self.metrics.run(redshift, statements, phase="rollup", autocommit=False)
+        self.log.info("Rollup tables {} are up to date".format(", ".join(partitions)))
+        return partitions
@@ -1,11 +1,15 @@
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
-from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
-from sodapy import Socrata
-import pandas as pd
-from io import StringIO
-import boto3
-import configparser
+from helpers.staging_files import MonthPartWriters, ParquetPageWriter, write_frame
+from helpers.intervals import months_in_interval
+from helpers.change_detection import ExtractChanges
+from helpers.instrumentation import instrumented
+from helpers.clients import bigquery_client, s3_client, socrata_app_token, socrata_client
+from helpers.stations import StationIndex, city_station, gsod_stations, interval_days
+from urllib.parse import urlparse
+import asyncio
+import csv
+import io
 
 
 class SocrataToS3Operator(BaseOperator):
@@ -18,63 +22,436 @@ class SocrataToS3Operator(BaseOperator):
         AWS credentials
     folder : str
         target S3 bucket folder
+    paginate : bool
+        pull the month page by page and stream every page to S3 instead of issuing one capped query
+    page_size : int
+        number of rows requested per page in paginated mode
+    output_format : str
+        format of the S3 object, either "csv" or "parquet" (typed and snappy compressed)
+    passthrough : bool
+        stream the raw bytes of the Socrata .csv endpoint into an S3 multipart upload, without pandas. The bytes
+        carry no station column, so these extracts cannot feed the fact table, whose key needs a station
+    num_parts : int
+        number of similar-sized objects every month is split into; more than one part (or compression) also
+        writes a COPY manifest so Redshift loads the parts in parallel
+    compress : bool
+        gzip compress the parts
+    skip_unchanged : bool
+        only upload the objects whose content fingerprint differs from the existing ones, and push `changed`
+        to XCom telling whether any month differs from the one last loaded into Redshift
+    concurrency : int
+        number of page requests kept in flight; above 1 the pages of all months of the interval are fetched
+        concurrently with an asyncio client and written to S3 in order
+    requests_per_second : float
+        request rate allowed for the app token in concurrent mode, None for no limit
+    max_retries : int
+        number of retries of a page request answered with 429 or 5xx in concurrent mode
+    socrata_url : str
+        URL of the Socrata domain, e.g. of a local fake server
+    bbox : list
+        [south, west, north, east] bounding box of the weather pull; every crime is assigned to the nearest GSOD
+        station of the box with a KD-tree built once per run. Without it, and for the crimes without a location,
+        the station is helpers.stations.city_station, joined to the weather of all stations.
 
     Methods
     -------
     execute():
-        Executes the data pulling from Chicago Data portal and loading it into S3.
+        Executes the data pulling from Chicago Data portal and loading it into S3, one object per month of the
+        data interval. Returns the number of rows written to S3.
+    get_socrata_client(socrata_key):
+        Returns the Socrata client, override it to run against a local stand-in.
+    get_bigquery_client():
+        Returns the BigQuery client reading the GSOD stations, override it to run against a local stand-in.
+    load_station_index(context):
+        Returns the index of the GSOD stations of the bbox reporting in the data interval, None without a bbox.
+    assign_stations(df):
+        Adds the nearest weather station of every crime of an extracted DataFrame as its station column.
     """
 
     ui_color = '#358140'
 
+    columns = ["date", "block", "primary_type", "description",
+               "arrest", "domestic", "district", "ward", "community_area", "latitude", "longitude"]
+
+    page_query = """
+            select
+               :id, {columns}
+            where
+               date_extract_y(date) = '{year}'
+               and date_extract_m(date) = '{month}'
+               and :id > '{last_id}'
+            order by :id
+            limit {page_size}
+            """
+
+    # Keyset paging on the unique id column, the first column of the extract; the :id of the paginated mode would
+    # add a column to the staged CSV.
+    passthrough_query = """
+            select
+               id, {columns}
+            where
+               date_extract_y(date) = '{year}'
+               and date_extract_m(date) = '{month}'
+               and id > {last_id}
+            order by id
+            limit {page_size}
+            """
+
+    month_filter = "date_extract_y(date) = '{year}' and date_extract_m(date) = '{month}'"
+
+    offset_page_query = """
+            select
+               {columns}
+            where
+               {where}
+            order by :id
+            limit {page_size}
+            offset {offset}
+            """
 
     @apply_defaults
     def __init__(self,
                  aws_credentials_id="",
                  folder="",
+                 paginate=False,
+                 page_size=50000,
+                 output_format="csv",
+                 passthrough=False,
+                 num_parts=1,
+                 compress=False,
+                 skip_unchanged=False,
+                 concurrency=1,
+                 requests_per_second=None,
+                 max_retries=5,
+                 socrata_url="https://data.cityofchicago.org",
+                 bbox=None,
                  provide_context=True,
                  *args, **kwargs):
         super(SocrataToS3Operator, self).__init__(*args, **kwargs)
+        if passthrough and output_format != "csv":
+            raise ValueError("Passthrough mode only supports the csv output format")
+        if passthrough and concurrency > 1:
+            raise ValueError("Passthrough mode streams one page at a time and cannot run concurrently")
+        if compress and output_format == "parquet":
+            raise ValueError("Parquet parts are compressed internally and cannot be gzip compressed")
+        if bbox and passthrough:
+            raise ValueError("Stations are assigned to extracted rows and cannot be combined with passthrough mode")
         self.aws_credentials_id = aws_credentials_id
         self.folder = folder
+        self.paginate = paginate
+        self.page_size = page_size
+        self.output_format = output_format
+        self.passthrough = passthrough
+        self.num_parts = num_parts
+        self.compress = compress
+        self.skip_unchanged = skip_unchanged
+        self.concurrency = concurrency
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.socrata_url = socrata_url
+        self.bbox = bbox
+        self.station_index = None
         self.provide_context = provide_context
 
 
+    @instrumented
     def execute(self, context):
-        aws_hook = AwsBaseHook(self.aws_credentials_id, client_type="s3")
-        self.log.info("Getting AWS credentials")
-        credentials = aws_hook.get_credentials()
+        with self.metrics.phase("auth"):
+            self.log.info("Getting AWS credentials")
+            s3 = s3_client(self.aws_credentials_id)
+            socrata_key = socrata_app_token()
 
+        self.log.info("Pulling crime data via Socrata API")
+        self.station_index = self.load_station_index(context)
 
-        year = context["data_interval_start"].date().year
-        month = context["data_interval_start"].date().strftime('%m')
+        changes = ExtractChanges(s3, "udacitycapstoneprojectbucket", self.folder, detect=self.skip_unchanged)
+        months = months_in_interval(context)
+        if self.concurrency > 1:
+            row_count = asyncio.run(self.pull_months_concurrently(socrata_key, s3, months, changes))
+        else:
+            client = self.get_socrata_client(socrata_key)
+            row_count = 0
+            for year, month in months:
+                with self.open_parts(s3, year, month) as parts:
+                    month_rows = self.pull_month(client, parts, year, month)
+                self.log_month(changes, year, month, parts, month_rows)
+                row_count += month_rows
+        changes.push(context)
+        self.metrics.count("rows", row_count)
 
-        self.log.info("Pulling crime data via Socrata API")
+        self.log.info("Successfully loaded {} crime records to S3 folder {}".format(row_count, self.folder))
+        return row_count
+
+    def get_socrata_client(self, socrata_key):
+        return socrata_client(urlparse(self.socrata_url).netloc, socrata_key)
+
+    def get_bigquery_client(self):
+        return bigquery_client()
+
+    def load_station_index(self, context):
+        if not self.bbox:
+            return None
+        with self.metrics.phase("stations"):
+            stations = gsod_stations(self.get_bigquery_client(), self.bbox,
+                                     *interval_days(months_in_interval(context)))
+        if not stations:
+            raise ValueError("No GSOD station inside {} reported in the data interval".format(self.bbox))
+        with self.metrics.phase("index"):
+            station_index = StationIndex(stations)
+        self.log.info("Assigning crimes to the nearest of {} weather stations".format(len(stations)))
+        return station_index
 
-        config = configparser.ConfigParser()
-        config.read_file(open('dags/support/dwh.cfg'))
-        socrata_key = config.get('SOCRATA', 'key')
+    def assign_stations(self, df):
+        if self.station_index is None:
+            df["station"] = city_station
+            return df
+        with self.metrics.phase("assign"):
+            df["station"] = self.station_index.assign(df["latitude"], df["longitude"])
+        return df
 
-        client = Socrata('data.cityofchicago.org', socrata_key)
+    def pull_month(self, client, parts, year, month):
+        if self.passthrough:
+            return self.stream_csv_passthrough(client, parts, year, month)
+        if self.paginate:
+            return self.stream_pages(client, parts, year, month)
+
+        import pandas as pd
         query = f"""
             select
-               date, block, primary_type, description,
-               arrest, domestic, district, ward, community_area
+               {", ".join(SocrataToS3Operator.columns)}
             where
                date_extract_y(date) = '{year}'
                and date_extract_m(date) = '{month}'
             limit 30000
             """
 
-        results = client.get("crimes", query=query)
+        with self.metrics.phase("extract"):
+            results = client.get("crimes", query=query)
+
+        with self.metrics.phase("serialize"):
+            results_df = self.assign_stations(pd.DataFrame.from_records(results, columns=SocrataToS3Operator.columns))
+            self.log.info("{}".format(results_df.head()))
+            write_frame(results_df, parts, "crime", self.output_format)
+        return len(results_df)
+
+    def log_month(self, changes, year, month, parts, month_rows):
+        month_changed = changes.add(year, month, parts)
+        self.log.info("Loaded {} crime records of {}-{} to S3 (uploaded: {}, changed since last load: {})".format(
+            month_rows, year, month, parts.changed, month_changed))
+
+    def open_parts(self, s3, year, month):
+        return MonthPartWriters(s3, "udacitycapstoneprojectbucket", self.folder, year, month,
+                                num_parts=self.num_parts,
+                                data_format=self.output_format,
+                                compress=self.compress,
+                                skip_unchanged=self.skip_unchanged,
+                                metrics=self.metrics)
+
+    def stream_pages(self, client, parts, year, month):
+        """
+        Pulls the month with keyset paging on the Socrata row id and streams each page into a multipart upload,
+        so only one page is held in memory at a time. Pages are dealt round robin to the parts.
+        Returns the total number of rows written.
+        """
+        row_count = 0
+        page_number = 0
+        last_id = ""
+        parquet_writers = self.open_page_writers(parts)
+        while True:
+            query = SocrataToS3Operator.page_query.format(
+                columns=", ".join(SocrataToS3Operator.columns),
+                year=year,
+                month=month,
+                last_id=last_id,
+                page_size=self.page_size)
+            with self.metrics.phase("extract"):
+                page = client.get("crimes", query=query)
+            if not page:
+                break
+            last_id = page[-1][":id"]
+
+            row_count += self.write_page(parts, parquet_writers, page, page_number, row_count)
+            page_number += 1
+            self.log.info("Streamed {} crime records to S3 so far".format(row_count))
+
+            if len(page) < self.page_size:
+                break
+        self.close_page_writers(parquet_writers)
+        return row_count
+
+    def open_page_writers(self, parts):
+        if self.output_format == "parquet":
+            return [ParquetPageWriter("crime", writer) for writer in parts.writers]
+        return None
+
+    def close_page_writers(self, parquet_writers):
+        with self.metrics.phase("serialize"):
+            for parquet_writer in parquet_writers or []:
+                parquet_writer.close()
+
+    def write_page(self, parts, parquet_writers, page, page_number, first_id):
+        """Writes one page of records to part page_number % num_parts and returns the number of rows written."""
+        import pandas as pd
+        part = page_number % parts.num_parts
+        with self.metrics.phase("serialize"):
+            page_df = self.assign_stations(pd.DataFrame.from_records(page, columns=SocrataToS3Operator.columns))
+            if parquet_writers is not None:
+                parquet_writers[part].write_page(page_df, first_id=first_id)
+            else:
+                page_df.index += first_id
+                parts.writers[part].write(page_df.to_csv(header=page_number < parts.num_parts))
+        return len(page_df)
+
+    async def pull_months_concurrently(self, socrata_key, s3, months, changes):
+        """
+        Counts the rows of every month, then fetches all pages of all months with offset paging, keeping up to
+        `concurrency` requests in flight. Pages are reassembled in order, so every month is written exactly as
+        the sequential paginated mode would write it. Pages added after the count are fetched at the end of the
+        month. Returns the total number of rows written.
+        """
+        from helpers.socrata_async import AsyncSocrataClient
+        async with AsyncSocrataClient(self.socrata_url, socrata_key,
+                                      concurrency=self.concurrency,
+                                      requests_per_second=self.requests_per_second,
+                                      max_retries=self.max_retries) as client:
+            wheres = [SocrataToS3Operator.month_filter.format(year=year, month=month) for year, month in months]
+            with self.metrics.phase("extract"):
+                counts = await asyncio.gather(*[client.count("crimes", where) for where in wheres])
+            page_counts = [-(-count // self.page_size) for count in counts]
+            pages = client.ordered("crimes", [self.offset_query(where, page_number)
+                                              for where, page_count in zip(wheres, page_counts)
+                                              for page_number in range(page_count)])
+            row_count = 0
+            try:
+                for (year, month), where, page_count in zip(months, wheres, page_counts):
+                    with self.open_parts(s3, year, month) as parts:
+                        parquet_writers = self.open_page_writers(parts)
+                        month_rows = 0
+                        page = []
+                        for page_number in range(page_count):
+                            with self.metrics.phase("extract"):
+                                page = await pages.__anext__()
+                            month_rows += self.write_page(parts, parquet_writers, page, page_number, month_rows)
+                        page_number = page_count
+                        while len(page) == self.page_size:
+                            with self.metrics.phase("extract"):
+                                page = await client.get("crimes", self.offset_query(where, page_number))
+                            if not page:
+                                break
+                            month_rows += self.write_page(parts, parquet_writers, page, page_number, month_rows)
+                            page_number += 1
+                        self.close_page_writers(parquet_writers)
+                    self.log_month(changes, year, month, parts, month_rows)
+                    row_count += month_rows
+            finally:
+                await pages.aclose()
+            self.log.info("Issued {} Socrata requests, {} of them retries".format(
+                client.request_count, client.retry_count))
+            self.metrics.count("requests", client.request_count)
+            self.metrics.count("retries", client.retry_count)
+        return row_count
+
+    def offset_query(self, where, page_number):
+        return SocrataToS3Operator.offset_page_query.format(
+            columns=", ".join(SocrataToS3Operator.columns),
+            where=where,
+            page_size=self.page_size,
+            offset=page_number * self.page_size)
 
-        results_df = pd.DataFrame.from_records(results)
-        self.log.info("{}".format(results_df.head()))
-        s3 = boto3.client('s3', aws_access_key_id=credentials.access_key, aws_secret_access_key=credentials.secret_key)
-        csv_buffer = StringIO()
-        results_df.to_csv(csv_buffer)
-        rendered_key = "{}/{}-{}.csv".format(self.folder, year, month)
-        s3.put_object(Bucket="udacitycapstoneprojectbucket", Key=rendered_key, Body=csv_buffer.getvalue())
+    def stream_csv_passthrough(self, client, parts, year, month):
+        """
+        Streams the raw response of the Socrata .csv endpoint page by page into multipart uploads, dealing the
+        pages round robin to the parts, with keyset paging on the id of the last record of every page. The header
+        is kept from the first page of every part only. Returns the number of rows written.
+        """
+        url = "https://{}/resource/{}.csv".format(client.domain, "crimes")
+        row_count = 0
+        page_number = 0
+        last_id = -1
+        while True:
+            query = SocrataToS3Operator.passthrough_query.format(
+                columns=", ".join(SocrataToS3Operator.columns),
+                year=year,
+                month=month,
+                last_id=last_id,
+                page_size=self.page_size)
+            with self.metrics.phase("extract"):
+                response = client.session.get(url, params={"$query": query}, stream=True, timeout=client.timeout)
+                response.raise_for_status()
+                page_rows, last_record = self.copy_csv_stream(response.iter_content(chunk_size=1024 * 1024),
+                                                              parts.writers[page_number % parts.num_parts],
+                                                              keep_header=page_number < parts.num_parts)
+                response.close()
+            page_number += 1
+            row_count += page_rows
+            self.log.info("Streamed {} crime records to S3 so far".format(row_count))
+            if page_rows < self.page_size:
+                break
+            last_id = int(next(csv.reader(io.StringIO(last_record.decode("utf-8"))))[0])
+        return row_count
 
-        self.log.info("Successfully loaded crime data to S3".format(self.folder))
+    @staticmethod
+    def copy_csv_stream(chunks, writer, keep_header=True):
+        """
+        Copies CSV chunks into the writer, optionally dropping the header line, and returns the number of records
+        and the bytes of the last one. A line break ends a record only outside quotes, i.e. after an even number
+        of quote characters (an escaped quote is doubled), so the quote parity is carried across chunks and the
+        line breaks inside quoted values are not counted. A last record without a line break is counted too and
+        terminated, so the next page written to the same part starts on its own line.
+        """
+        header_done = False
+        record_count = 0
+        in_quotes = False
+        last_record = b""
+        tail = b""
+        for chunk in chunks:
+            if not header_done:
+                newline = chunk.find(b"\n")
+                if newline == -1:
+                    if keep_header:
+                        writer.write(chunk)
+                    continue
+                if keep_header:
+                    writer.write(chunk[:newline + 1])
+                chunk = chunk[newline + 1:]
+                header_done = True
+            segments = chunk.split(b'"')
+            record_count += b"".join(segments[1 if in_quotes else 0::2]).count(b"\n")
+            record_ends = SocrataToS3Operator.last_record_ends(chunk, segments, in_quotes)
+            if record_ends:
+                start = record_ends[1] + 1 if len(record_ends) > 1 else 0
+                last_record = (b"" if start else tail) + chunk[start:record_ends[0]]
+                tail = chunk[record_ends[0] + 1:]
+            else:
+                tail += chunk
+            in_quotes = in_quotes != (len(segments) % 2 == 0)
+            writer.write(chunk)
+        if tail:
+            record_count += 1
+            last_record = tail
+        if tail or (keep_header and not header_done):
+            writer.write(b"\n")
+        return record_count, last_record
 
+    @staticmethod
+    def last_record_ends(chunk, segments, in_quotes):
+        """
+        Returns the offsets of the last two line breaks outside quotes of a chunk split on its quote characters,
+        last first, walking back from the end of the chunk.
+        """
+        ends = []
+        offset = len(chunk)
+        for index in range(len(segments) - 1, -1, -1):
+            segment = segments[index]
+            offset -= len(segment)
+            if (index % 2 == 1) == in_quotes:
+                position = len(segment)
+                while len(ends) < 2:
+                    position = segment.rfind(b"\n", 0, position)
+                    if position == -1:
+                        break
+                    ends.append(offset + position)
+                if len(ends) == 2:
+                    break
+            offset -= 1
+        return ends
@@ -1,11 +1,15 @@
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
-from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
-import pandas as pd
-from google.cloud import bigquery
-import os
+import csv
 from io import StringIO
-import boto3
+from helpers.staging_files import MonthPartWriters, write_frame
+from helpers.intervals import months_in_interval
+from helpers.change_detection import ExtractChanges
+from helpers.instrumentation import instrumented
+from helpers.clients import s3_client, bigquery_client
+from helpers.stations import bbox_filter, gsod_stations, interval_days
+
+
 class BigQueryToS3Operator(BaseOperator):
     """
     Implements the process of pulling and cleaning the weather data from the BigQuery and loading it into S3.
@@ -16,51 +20,253 @@ class BigQueryToS3Operator(BaseOperator):
         AWS credentials
     folder : str
         target S3 bucket folder
+    output_format : str
+        format of the S3 object, either "csv" or "parquet" (typed and snappy compressed)
+    row_streaming : bool
+        clean the data in BigQuery and stream the result rows, one page at a time re-serialized as CSV, into an S3
+        multipart upload, without pandas
+    page_size : int
+        number of rows fetched per result page in row streaming mode
+    num_parts : int
+        number of similar-sized objects every month is split into; more than one part (or compression) also
+        writes a COPY manifest so Redshift loads the parts in parallel
+    compress : bool
+        gzip compress the parts
+    skip_unchanged : bool
+        only upload the objects whose content fingerprint differs from the existing ones, and push `changed`
+        to XCom telling whether any month differs from the one last loaded into Redshift
+    station : str
+        GSOD station number, used when no bounding box is given
+    bbox : list
+        [south, west, north, east] bounding box in degrees; every GSOD station inside it that reported in the data
+        interval is pulled, the same station set the crime pull assigns the crimes to
+    cache_dir : str
+        directory of the local yearly extract cache; when set the whole year is queried once and sliced locally
+    cache_max_bytes : int
+        size budget of the cache directory
+    cache_ttl : int
+        number of seconds a cached current-year extract stays fresh; past years never expire
 
     Methods
     -------
     execute():
-        Executes the data pulling from Chicago Data portal and loading it into S3.
+        Executes the data pulling from BigQuery and loading it into S3, one object per month of the data interval.
+    get_bigquery_client():
+        Returns the BigQuery client, override it to run against a local stand-in.
     """
 
     ui_color = '#358140'
 
+    # Column order of the extracts, matching staging_weather after the id.
+    columns = ["year", "mo", "da", "temp", "wdsp", "fog", "rain_drizzle", "snow_ice_pellets", "thunder",
+               "weather_date", "station", "latitude", "longitude"]
+
+    # GSOD stations are identified by their USAF and WBAN numbers together, e.g. 725340-14819 for Chicago Midway.
+    streaming_query = """
+            SELECT ROW_NUMBER() OVER (ORDER BY gsod.da, gsod.stn, gsod.wban) - 1 AS id,
+                   gsod.year, gsod.mo, gsod.da, gsod.temp, gsod.wdsp, gsod.fog, gsod.rain_drizzle,
+                   IF(gsod.snow_ice_pellets = '10', '1', gsod.snow_ice_pellets) AS snow_ice_pellets,
+                   IF(gsod.thunder IN ('1000', '10'), '1', gsod.thunder) AS thunder,
+                   DATE(CAST(gsod.year AS INT64), CAST(gsod.mo AS INT64), CAST(gsod.da AS INT64)) AS weather_date,
+                   CONCAT(gsod.stn, '-', gsod.wban) AS station, stations.lat AS latitude, stations.lon AS longitude
+            FROM bigquery-public-data.noaa_gsod.gsod{year} AS gsod
+            JOIN bigquery-public-data.noaa_gsod.stations AS stations
+              ON gsod.stn = stations.usaf AND gsod.wban = stations.wban
+            WHERE {stations} AND gsod.mo like '{month}'
+            ORDER BY gsod.da, gsod.stn, gsod.wban
+            """
+
+    year_query = """
+            SELECT gsod.year, gsod.mo, gsod.da, gsod.temp, gsod.wdsp, gsod.fog, gsod.rain_drizzle,
+                   gsod.snow_ice_pellets, gsod.thunder,
+                   CONCAT(gsod.stn, '-', gsod.wban) AS station, stations.lat AS latitude, stations.lon AS longitude
+            FROM bigquery-public-data.noaa_gsod.gsod{year} AS gsod
+            JOIN bigquery-public-data.noaa_gsod.stations AS stations
+              ON gsod.stn = stations.usaf AND gsod.wban = stations.wban
+            WHERE {stations}
+            """
+
+    month_query = year_query + " AND gsod.mo like '{month}'"
 
     @apply_defaults
     def __init__(self,
                  aws_credentials_id="",
                  folder="",
+                 output_format="csv",
+                 row_streaming=False,
+                 page_size=10000,
+                 num_parts=1,
+                 compress=False,
+                 skip_unchanged=False,
+                 station="725340",
+                 bbox=None,
+                 cache_dir=None,
+                 cache_max_bytes=512 * 1024 * 1024,
+                 cache_ttl=24 * 60 * 60,
                  provide_context=True,
                  *args, **kwargs):
         super(BigQueryToS3Operator, self).__init__(*args, **kwargs)
+        if row_streaming and output_format != "csv":
+            raise ValueError("Row streaming mode only supports the csv output format")
+        if row_streaming and cache_dir:
+            raise ValueError("Row streaming mode does not use the yearly cache")
+        if compress and output_format == "parquet":
+            raise ValueError("Parquet parts are compressed internally and cannot be gzip compressed")
         self.aws_credentials_id = aws_credentials_id
         self.folder = folder
+        self.output_format = output_format
+        self.row_streaming = row_streaming
+        self.page_size = page_size
+        self.num_parts = num_parts
+        self.compress = compress
+        self.skip_unchanged = skip_unchanged
+        self.station = station
+        self.bbox = bbox
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_ttl = cache_ttl
         self.provide_context = provide_context
 
+    @instrumented
     def execute(self, context):
-        aws_hook = AwsBaseHook(self.aws_credentials_id, client_type="s3")
-        self.log.info("Getting AWS credentials")
-        credentials = aws_hook.get_credentials()
-
-        SERVICE_ACCOUNT_JSON = os.environ['GOOGLE_APPLICATION_CREDENTIALS']
-        client = bigquery.Client.from_service_account_json(SERVICE_ACCOUNT_JSON)
+        import pandas as pd
+        with self.metrics.phase("auth"):
+            self.log.info("Getting AWS credentials")
+            s3 = s3_client(self.aws_credentials_id)
+            client = self.get_bigquery_client()
 
         self.log.info("Pulling data from BigQuery")
-        year = context["data_interval_start"].date().year
-        month = context["data_interval_start"].date().strftime('%m')
-        QUERY = f"""
-            SELECT year, mo, da, temp, wdsp, fog, rain_drizzle, snow_ice_pellets, thunder FROM bigquery-public-data.noaa_gsod.gsod{year} 
-                    WHERE stn like '725340' AND mo like '{month}'
-                    """
-        query_job = client.query(QUERY)
-        query_result = query_job.result()
-        results_df = query_result.to_dataframe()
-        results_df["thunder"].replace(["1000","10"],"1", inplace =True)
-        results_df["snow_ice_pellets"].replace("10", "1", inplace=True)
-        self.log.info("{}".format(results_df.head()))
-
-        s3 = boto3.client('s3', aws_access_key_id=credentials.access_key, aws_secret_access_key=credentials.secret_key)
-        csv_buffer = StringIO()
-        results_df.to_csv(csv_buffer)
-        rendered_key = "{}/{}-{}.csv".format(self.folder, year, month)
-        s3.put_object(Bucket="udacitycapstoneprojectbucket", Key=rendered_key, Body=csv_buffer.getvalue())
\ No newline at end of file
+        months = months_in_interval(context)
+
+        first_day, last_day = interval_days(months)
+        station_ids = None
+        if self.bbox and (self.cache_dir or len(months) > 1):
+            # The yearly extracts hold every station of the year; keep the ones of the run's station set.
+            with self.metrics.phase("stations"):
+                station_ids = [station for station, _, _ in gsod_stations(client, self.bbox, first_day, last_day)]
+
+        changes = ExtractChanges(s3, "udacitycapstoneprojectbucket", self.folder, detect=self.skip_unchanged)
+        row_count = 0
+        year_frames = {}
+        for year, month in months:
+            if self.row_streaming:
+                with self.open_parts(s3, year, month) as parts:
+                    row_count += self.stream_rows(client, parts, year, month, self.station_filter(first_day, last_day))
+                self.log_changes(changes, year, month, parts)
+                continue
+
+            if self.cache_dir or len(months) > 1:
+                # Range runs and cached runs read every yearly table once and slice the months locally.
+                if year not in year_frames:
+                    with self.metrics.phase("extract"):
+                        year_frames = {year: self.pull_year(client, year)}
+                year_df = year_frames[year]
+                month_rows = year_df["mo"] == month
+                if station_ids is not None:
+                    month_rows &= year_df["station"].isin(station_ids)
+                results_df = year_df[month_rows].reset_index(drop=True)
+            else:
+                QUERY = BigQueryToS3Operator.month_query.format(year=year, month=month,
+                                                                stations=self.station_filter(first_day, last_day))
+                with self.metrics.phase("extract"):
+                    query_job = client.query(QUERY)
+                    query_result = query_job.result()
+                    results_df = query_result.to_dataframe()
+            results_df["thunder"] = results_df["thunder"].replace(["1000", "10"], "1")
+            results_df["snow_ice_pellets"] = results_df["snow_ice_pellets"].replace("10", "1")
+            results_df["weather_date"] = pd.to_datetime(
+                results_df["year"].astype(str) + "-" + results_df["mo"].astype(str) + "-" + results_df["da"].astype(str)
+            ).dt.strftime("%Y-%m-%d")
+            results_df = results_df[BigQueryToS3Operator.columns]
+            self.log.info("{}".format(results_df.head()))
+
+            with self.open_parts(s3, year, month) as parts:
+                with self.metrics.phase("serialize"):
+                    write_frame(results_df, parts, "weather", self.output_format)
+            self.log_changes(changes, year, month, parts)
+            row_count += len(results_df)
+        changes.push(context)
+        self.metrics.count("rows", row_count)
+
+        self.log.info("Loaded {} weather records to S3 folder {}".format(row_count, self.folder))
+        return row_count
+
+    def log_changes(self, changes, year, month, parts):
+        month_changed = changes.add(year, month, parts)
+        self.log.info("Weather of {}-{} uploaded: {}, changed since last load: {}".format(
+            year, month, parts.changed, month_changed))
+
+    def get_bigquery_client(self):
+        return bigquery_client()
+
+    def station_filter(self, first_day, last_day):
+        """
+        Returns the condition of the GSOD queries selecting the stations of the bounding box that reported between
+        the two days (YYYYMMDD), or the station.
+        """
+        if self.bbox:
+            return bbox_filter(self.bbox, first_day, last_day)
+        return "gsod.stn like '{}'".format(self.station)
+
+    def station_key(self):
+        return "bbox:{},{},{},{}".format(*self.bbox) if self.bbox else self.station
+
+    def pull_year(self, client, year):
+        """
+        Returns the yearly station extract of every station that reported in the year, served from the local cache
+        when cache_dir is set and querying BigQuery only on a cache miss.
+        """
+        query = BigQueryToS3Operator.year_query.format(
+            year=year, stations=self.station_filter("{}0101".format(year), "{}1231".format(year)))
+
+        def fetch():
+            self.log.info("Querying the whole year {} for station {}".format(year, self.station_key()))
+            return client.query(query).result().to_dataframe()
+
+        if not self.cache_dir:
+            return fetch()
+        from helpers.weather_cache import GsodYearCache
+        cache = GsodYearCache(self.cache_dir, self.cache_max_bytes, self.cache_ttl)
+        return cache.get_or_fetch(year, self.station_key(), query, fetch)
+
+    def open_parts(self, s3, year, month):
+        return MonthPartWriters(s3, "udacitycapstoneprojectbucket", self.folder, year, month,
+                                num_parts=self.num_parts,
+                                data_format=self.output_format,
+                                compress=self.compress,
+                                skip_unchanged=self.skip_unchanged,
+                                metrics=self.metrics)
+
+    def stream_rows(self, client, parts, year, month, station_filter):
+        """
+        Runs the cleaning query in BigQuery and writes the result rows, re-serialized as CSV a page at a time, into
+        multipart uploads, dealing the pages round robin to the parts and holding at most one result page in
+        memory. The rows pass through Python, unlike the byte passthrough of the crime operator. The stations are
+        selected by the `station_filter` condition. Returns the number of rows written.
+        """
+        with self.metrics.phase("extract"):
+            query_job = client.query(BigQueryToS3Operator.streaming_query.format(
+                year=year, month=month, stations=station_filter))
+            rows = query_job.result(page_size=self.page_size)
+            pages = iter(rows.pages)
+        header = [field.name for field in rows.schema]
+        row_count = 0
+        page_number = 0
+        page_buffer = StringIO()
+        csv_writer = csv.writer(page_buffer)
+        while True:
+            with self.metrics.phase("extract"):
+                page = next(pages, None)
+            if page is None:
+                break
+            with self.metrics.phase("serialize"):
+                if page_number < parts.num_parts:
+                    csv_writer.writerow(header)
+                for row in page:
+                    csv_writer.writerow(row.values())
+                    row_count += 1
+                parts.writers[page_number % parts.num_parts].write(page_buffer.getvalue())
+                page_buffer.seek(0)
+                page_buffer.truncate()
+            page_number += 1
+        return row_count
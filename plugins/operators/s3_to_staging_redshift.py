@@ -1,12 +1,21 @@
-from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
-from airflow.providers.amazon.aws.hooks.base_aws import AwsBaseHook
+from helpers.staging_files import staging_key, manifest_key
+from helpers.scoped_staging import scoped_table_name
+from helpers.intervals import months_in_interval
+from helpers.manifest import write_manifest
+from helpers.instrumentation import instrumented
+from helpers.clients import aws_credentials, s3_client
+from helpers.warehouse import warehouse_hook, is_embedded
+import json
 
 class StageToRedshiftOperator(BaseOperator):
     """
     Implements the process of pulling the data from S3 and loading them into staging tables in Redshift.
 
+    A data interval spanning several months (range backfill) is loaded with a single COPY driven by a manifest
+    listing the monthly objects of the range.
+
     Attributes
     ----------
     redshift_conn_id : str
@@ -19,12 +28,27 @@ class StageToRedshiftOperator(BaseOperator):
         the source S3 bucket that contains the raw data
     s3_key : str
         path to the S3 subfolder that contains the raw data
+    data_format : str
+        format of the staged objects, either "csv" or "parquet"
+    scoped_staging : bool
+        copy into a staging table of the run's data interval, created LIKE the target table, instead of
+        appending to the target table itself
+    split_parts : bool
+        the pull operator split every month into parts (num_parts); the month manifests are used for the COPY
+    compression : str
+        "gzip" when the CSV parts are gzip compressed; compressed extracts are only listed by the month manifests,
+        so it requires split_parts
 
 
     Methods
     -------
     execute():
         Executes the data pulling and loading from S3 to Redshift
+    copy(redshift, target_table, s3_path, credentials, manifest):
+        Runs the COPY of an object or manifest into the target table, override it to load a local stand-in.
+        On the embedded DuckDB backend the objects are read with read_csv or read_parquet instead.
+    copy_statement(target_table, s3_path, credentials, manifest):
+        Returns the COPY statement run by copy().
     """
 
     ui_color = '#436EEE'
@@ -38,9 +62,49 @@ class StageToRedshiftOperator(BaseOperator):
         CSV
         COMPUPDATE OFF
         IGNOREHEADER 1
+        FILLRECORD
         timeformat 'YYYY-MM-DDTHH:MI:SS'
     """
 
+    copy_parquet_sql = """
+        COPY {}
+        FROM '{}'
+        ACCESS_KEY_ID '{}'
+        SECRET_ACCESS_KEY '{}'
+        REGION 'us-west-2'
+        FORMAT AS PARQUET
+    """
+
+    manifest_option = """
+        MANIFEST
+    """
+
+    gzip_option = """
+        GZIP
+    """
+
+    # Embedded DuckDB backend (helpers.warehouse). Like COPY, CSV columns are loaded by position and a record
+    # missing trailing columns is padded with NULLs (FILLRECORD); every field is read as text and cast on insert.
+    read_csv_sql = """
+        INSERT INTO {}
+        SELECT * FROM read_csv([{}], auto_detect = false, header = true, delim = ',', quote = '"', escape = '"',
+                               null_padding = true, columns = {{{}}}, compression = '{}')
+    """
+
+    read_parquet_sql = """
+        INSERT INTO {}
+        SELECT * FROM read_parquet([{}])
+    """
+
+    read_manifest_sql = "SELECT content FROM read_text('{}')"
+
+    describe_sql = "DESCRIBE {}"
+
+    create_scoped_sql = [
+        "DROP TABLE IF EXISTS {scoped}",
+        "CREATE TABLE {scoped} (LIKE {table})",
+    ]
+
     @apply_defaults
     def __init__(self,
                  redshift_conn_id="",
@@ -48,31 +112,109 @@ class StageToRedshiftOperator(BaseOperator):
                  source_key = "",
                  target_table="",
                  s3_bucket="",
+                 data_format="csv",
+                 scoped_staging=False,
+                 split_parts=False,
+                 compression=None,
                  *args, **kwargs):
         super(StageToRedshiftOperator, self).__init__(*args, **kwargs)
+        if compression and not split_parts:
+            raise ValueError("Compressed extracts are staged from their month manifests and need split_parts")
         self.redshift_conn_id = redshift_conn_id
         self.aws_credentials_id = aws_credentials_id
         self.target_table = target_table
         self.s3_bucket = s3_bucket
         self.source_key = source_key
+        self.data_format = data_format
+        self.scoped_staging = scoped_staging
+        self.split_parts = split_parts
+        self.compression = compression
 
+    @instrumented
     def execute(self, context):
-        aws_hook = AwsBaseHook(self.aws_credentials_id, client_type='redshift')
-        self.log.info("Getting AWS credentials")
-        credentials = aws_hook.get_credentials()
-        redshift = PostgresHook(postgres_conn_id=self.redshift_conn_id)
-
-        year = context["data_interval_start"].date().year
-        month = context["data_interval_start"].date().strftime('%m')
-        self.log.info("Copying data from S3 to Redshift table {}".format(self.target_table))
-        rendered_key = "{}/{}-{}.csv".format(self.source_key, year, month)
-        s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
-        formatted_sql = StageToRedshiftOperator.copy_sql.format(
-            self.target_table,
+        with self.metrics.phase("auth"):
+            self.log.info("Getting AWS credentials")
+            credentials = aws_credentials(self.aws_credentials_id)
+        redshift = warehouse_hook(self.redshift_conn_id)
+
+        months = months_in_interval(context)
+        target_table = self.target_table
+        if self.scoped_staging:
+            target_table = scoped_table_name(self.target_table, context)
+            self.metrics.run(redshift, [statement.format(scoped=target_table, table=self.target_table)
+                                        for statement in StageToRedshiftOperator.create_scoped_sql])
+        self.log.info("Copying data from S3 to Redshift table {}".format(target_table))
+        if len(months) > 1:
+            s3 = s3_client(self.aws_credentials_id)
+            with self.metrics.phase("manifest"):
+                s3_path = self.write_range_manifest(s3, context, months)
+        elif self.split_parts:
+            year, month = months[0]
+            s3_path = "s3://{}/{}".format(self.s3_bucket, manifest_key(self.source_key, year, month))
+        else:
+            year, month = months[0]
+            rendered_key = staging_key(self.source_key, year, month, self.data_format)
+            s3_path = "s3://{}/{}".format(self.s3_bucket, rendered_key)
+        self.copy(redshift, target_table, s3_path, credentials, manifest=len(months) > 1 or self.split_parts)
+
+        self.log.info("Successfully copied table {} to Redshift".format(target_table))
+
+    def copy(self, redshift, target_table, s3_path, credentials, manifest=False):
+        if is_embedded(redshift):
+            return self.copy_embedded(redshift, target_table, s3_path, credentials, manifest)
+        self.metrics.run(redshift, self.copy_statement(target_table, s3_path, credentials, manifest), phase="copy")
+
+    def copy_embedded(self, redshift, target_table, s3_path, credentials, manifest=False):
+        """Loads the object, or the objects of the manifest, with DuckDB's file readers; timed as the copy phase."""
+        redshift.s3_credentials = credentials
+        urls = [s3_path]
+        if manifest:
+            content = self.metrics.get_records(
+                redshift, StageToRedshiftOperator.read_manifest_sql.format(redshift.source_path(s3_path)),
+                phase="copy")[0][0]
+            urls = [entry["url"] for entry in json.loads(content)["entries"]]
+        sources = ", ".join("'{}'".format(redshift.source_path(url)) for url in urls)
+        if self.data_format == "parquet":
+            statement = StageToRedshiftOperator.read_parquet_sql.format(target_table, sources)
+        else:
+            columns = [row[0] for row in self.metrics.get_records(
+                redshift, StageToRedshiftOperator.describe_sql.format(target_table), phase="copy")]
+            statement = StageToRedshiftOperator.read_csv_sql.format(
+                target_table,
+                sources,
+                ", ".join("'{}': 'VARCHAR'".format(column) for column in columns),
+                self.compression or "auto")
+        rows = self.metrics.run(redshift, statement, phase="copy")
+        self.metrics.count("rows_copied", sum(rows))
+
+    def copy_statement(self, target_table, s3_path, credentials, manifest=False):
+        copy_sql = StageToRedshiftOperator.copy_parquet_sql if self.data_format == "parquet" else StageToRedshiftOperator.copy_sql
+        formatted_sql = copy_sql.format(
+            target_table,
             s3_path,
             credentials.access_key,
             credentials.secret_key)
+        if manifest:
+            formatted_sql += StageToRedshiftOperator.manifest_option
+        if self.compression == "gzip":
+            formatted_sql += StageToRedshiftOperator.gzip_option
+        return formatted_sql
 
-        redshift.run(formatted_sql)
-
-        self.log.info("Successfully copied table {} to Redshift".format(self.target_table))
+    def write_range_manifest(self, s3, context, months):
+        """Writes the COPY manifest listing the monthly objects (or parts) of a range and returns its S3 path."""
+        entries = []
+        for year, month in months:
+            if self.split_parts:
+                response = s3.get_object(Bucket=self.s3_bucket, Key=manifest_key(self.source_key, year, month))
+                for entry in json.loads(response["Body"].read())["entries"]:
+                    entries.append((entry["url"], entry.get("meta", {}).get("content_length")))
+                continue
+            key = staging_key(self.source_key, year, month, self.data_format)
+            content_length = s3.head_object(Bucket=self.s3_bucket, Key=key)["ContentLength"]
+            entries.append(("s3://{}/{}".format(self.s3_bucket, key), content_length))
+        range_manifest_key = "{}/manifests/{}_{}.manifest".format(
+            self.source_key,
+            context["data_interval_start"].strftime('%Y%m%d'),
+            context["data_interval_end"].strftime('%Y%m%d'))
+        self.log.info("Copying {} objects through manifest {}".format(len(entries), range_manifest_key))
+        return write_manifest(s3, self.s3_bucket, range_manifest_key, entries)
@@ -0,0 +1,60 @@
+import asyncio
+
+from airflow.triggers.base import BaseTrigger, TriggerEvent
+from helpers.redshift_data import data_api_client, statement_outcome, finished_statuses, failed_statuses
+
+
+class RedshiftStatementTrigger(BaseTrigger):
+    """
+    Polls a statement submitted through the Redshift Data API from the triggerer and fires once it finished,
+    failed or was aborted. The event carries the statement_outcome of the statement.
+
+    Attributes
+    ----------
+    statement_id : str
+        Data API statement id
+    aws_credentials_id : str
+        AWS credentials allowed to call the Data API
+    region_name : str
+        region of the cluster
+    poll_interval : float
+        seconds between two describe_statement calls
+    client : botocore client
+        Data API client; created from the credentials when not set, e.g. by a local stand-in
+
+    Methods
+    -------
+    run():
+        Yields one TriggerEvent when the statement reached a final status.
+    """
+
+    def __init__(self, statement_id, aws_credentials_id, region_name="us-west-2", poll_interval=10):
+        super(RedshiftStatementTrigger, self).__init__()
+        self.statement_id = statement_id
+        self.aws_credentials_id = aws_credentials_id
+        self.region_name = region_name
+        self.poll_interval = poll_interval
+        self.client = None
+
+    def serialize(self):
+        return ("triggers.redshift_data.RedshiftStatementTrigger", {
+            "statement_id": self.statement_id,
+            "aws_credentials_id": self.aws_credentials_id,
+            "region_name": self.region_name,
+            "poll_interval": self.poll_interval,
+        })
+
+    async def run(self):
+        # boto3 is blocking, so its calls run on the default executor and never stall the triggerer's event loop
+        loop = asyncio.get_event_loop()
+        if self.client is None:
+            self.client = await loop.run_in_executor(None, data_api_client, self.aws_credentials_id,
+                                                     self.region_name)
+        while True:
+            description = await loop.run_in_executor(
+                None, lambda: self.client.describe_statement(Id=self.statement_id))
+            if description["Status"] in finished_statuses + failed_statuses:
+                yield TriggerEvent(statement_outcome(description))
+                return
+            self.log.info("Statement {} is {}".format(self.statement_id, description["Status"]))
+            await asyncio.sleep(self.poll_interval)